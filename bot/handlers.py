@@ -2,27 +2,26 @@
 Telegram bot command and message handlers
 """
 import logging
-import os
-import tempfile
-from telegram import Update
+from typing import Awaitable, Callable, Optional
+from telegram import Bot, ReplyParameters, Update
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
-from bot.services.gemini_service import GeminiService
-from bot.services.youtube_service import YouTubeService
-from bot.services.removebg_service import RemoveBgService
-from bot.services.tmdb_service import TMDBService
-from bot.services.vision_service import VisionService
-from bot.utils.helpers import download_file, format_error_message
+from bot.services.registry import services
+from bot.utils.admission import admit_media
+from bot.utils.errors import UpstreamUnavailableError
+from bot.utils.helpers import create_progress_bar, download_file, format_error_message
+from bot.utils.file_ids import FileIdCache, file_id_cache
+from bot.utils.jobs import Job, job_queue
+from bot.utils.media import MediaBuffer
+from bot.utils.streaming import StreamingReply
+from bot.utils.tracing import span, track_handler
+from config import Config
 
 logger = logging.getLogger(__name__)
 
-# Initialize services
-gemini_service = GeminiService()
-youtube_service = YouTubeService()
-removebg_service = RemoveBgService()
-tmdb_service = TMDBService()
-vision_service = VisionService()
 
+@track_handler
 async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command"""
     welcome_message = """
@@ -43,6 +42,7 @@ Just send me a message or upload an image/video to get started!
     """
     await update.message.reply_text(welcome_message, parse_mode=ParseMode.MARKDOWN)
 
+@track_handler
 async def help_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /help command"""
     help_message = """
@@ -77,6 +77,7 @@ Example: `/movie The Matrix`
     """
     await update.message.reply_text(help_message, parse_mode=ParseMode.MARKDOWN)
 
+@track_handler
 async def gemini_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /ai command for Gemini AI assistant"""
     if not context.args:
@@ -89,13 +90,23 @@ async def gemini_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Send typing indicator
         await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
         
-        response = await gemini_service.generate_response(user_message)
+        if Config.GEMINI_STREAMING:
+            reply = StreamingReply(update.message, prefix="🧠 **AI Response:**\n\n", parse_mode=ParseMode.MARKDOWN)
+            async for chunk in services.get("gemini").generate_response_stream(user_message):
+                await reply.push(chunk)
+            await reply.finish()
+            return
+        
+        response = await services.get("gemini").generate_response(user_message)
         await update.message.reply_text(f"🧠 **AI Response:**\n\n{response}", parse_mode=ParseMode.MARKDOWN)
         
+    except UpstreamUnavailableError as e:
+        await update.message.reply_text(e.user_message)
     except Exception as e:
         logger.error(f"Error in Gemini handler: {e}")
         await update.message.reply_text(format_error_message("AI Assistant", str(e)))
 
+@track_handler
 async def youtube_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /youtube command for video search"""
     if not context.args:
@@ -108,7 +119,7 @@ async def youtube_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Send typing indicator
         await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
         
-        videos = await youtube_service.search_videos(search_query)
+        videos = await services.get("youtube").search_videos(search_query)
         
         if not videos:
             await update.message.reply_text("No videos found for your search query.")
@@ -124,10 +135,13 @@ async def youtube_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         await update.message.reply_text(response, parse_mode=ParseMode.MARKDOWN)
         
+    except UpstreamUnavailableError as e:
+        await update.message.reply_text(e.user_message)
     except Exception as e:
         logger.error(f"Error in YouTube handler: {e}")
         await update.message.reply_text(format_error_message("YouTube Search", str(e)))
 
+@track_handler
 async def movie_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /movie command for movie search"""
     if not context.args:
@@ -140,37 +154,46 @@ async def movie_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Send typing indicator
         await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
         
-        movie = await tmdb_service.search_movie(movie_name)
+        movie = await services.get("tmdb").search_movie(movie_name)
         
         if not movie:
             await update.message.reply_text(f"No movie found for: `{movie_name}`", parse_mode=ParseMode.MARKDOWN)
             return
         
         # Format movie details
-        response = f"🎬 **{movie['title']}** ({movie['year']})\n\n"
-        response += f"⭐ **Rating:** {movie['rating']}/10\n"
-        response += f"📅 **Release Date:** {movie['release_date']}\n"
-        response += f"🎭 **Genres:** {', '.join(movie['genres'])}\n"
-        response += f"⏱️ **Runtime:** {movie['runtime']} minutes\n\n"
-        response += f"📝 **Overview:**\n{movie['overview']}\n\n"
+        with span("format"):
+            response = f"🎬 **{movie['title']}** ({movie['year']})\n\n"
+            response += f"⭐ **Rating:** {movie['rating']}/10\n"
+            response += f"📅 **Release Date:** {movie['release_date']}\n"
+            response += f"🎭 **Genres:** {', '.join(movie['genres'])}\n"
+            response += f"⏱️ **Runtime:** {movie['runtime']} minutes\n\n"
+            response += f"📝 **Overview:**\n{movie['overview']}\n\n"
         
         if movie['poster_url']:
-            # Send poster image
-            await context.bot.send_photo(
+            # Send poster image; after the first send Telegram gets it by file_id instead of refetching the URL
+            await file_id_cache.send_photo(
+                context.bot,
+                [FileIdCache.url_key(movie['poster_url'])],
+                movie['poster_url'],
                 chat_id=update.effective_chat.id,
-                photo=movie['poster_url'],
                 caption=response,
                 parse_mode=ParseMode.MARKDOWN
             )
         else:
             await update.message.reply_text(response, parse_mode=ParseMode.MARKDOWN)
         
+    except UpstreamUnavailableError as e:
+        await update.message.reply_text(e.user_message)
     except Exception as e:
         logger.error(f"Error in movie handler: {e}")
         await update.message.reply_text(format_error_message("Movie Search", str(e)))
 
+@track_handler
 async def removebg_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /removebg command for background removal"""
+    # The next image this user sends in this chat gets its background removed.
+    # user_data is shared across chats, so remember which chat asked.
+    context.user_data['waiting_for_removebg'] = update.effective_chat.id
     await update.message.reply_text(
         "🖼️ **Background Removal Service**\n\n"
         "Please upload an image and I'll remove the background for you!\n\n"
@@ -179,89 +202,211 @@ async def removebg_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode=ParseMode.MARKDOWN
     )
 
+def _format_analysis(file_type: str, analysis: str) -> str:
+    """Format an image/video analysis for sending back to the user"""
+    if not analysis:
+        return f"Unable to analyze the {file_type}. Please try again."
+    
+    # Truncate analysis if too long and escape markdown
+    if len(analysis) > 3800:
+        analysis = analysis[:3800] + "..."
+    
+    # Remove problematic markdown characters
+    analysis = analysis.replace('*', '').replace('_', '').replace('[', '').replace(']', '')
+    
+    return f"👁️ {file_type.title()} Analysis:\n\n{analysis}"
+
+async def _reply_with_analysis(update: Update, file_type: str, analysis: str):
+    """Send an image/video analysis back to the user"""
+    await update.message.reply_text(_format_analysis(file_type, analysis))
+
+async def _enqueue_media_job(update: Update, kind: str, title: str, payload: dict):
+    """Acknowledge an upload with a status message and hand the work to the job queue"""
+    status = await update.message.reply_text(f"{title}\n{create_progress_bar(0, 1)}\n⏳ Queued")
+    await job_queue.enqueue(kind, {
+        **payload,
+        "chat_id": update.effective_chat.id,
+        "message_id": update.message.message_id,
+        "status_message_id": status.message_id,
+        "title": title,
+    })
+
+async def _job_progress(bot: Bot, job: Job, step: int, total: int, stage: str):
+    """Show a job's progress in its status message"""
+    payload = job.payload
+    try:
+        await bot.edit_message_text(
+            f"{payload['title']}\n{create_progress_bar(step, total)}\n{stage}",
+            chat_id=payload["chat_id"],
+            message_id=payload["status_message_id"],
+        )
+    except BadRequest as e:
+        # "Message is not modified" after a resume, or the user deleted the status message
+        logger.debug(f"Could not update status of job {job.id}: {e}")
+
+async def _remove_background(download: Callable[[], Awaitable[MediaBuffer]]) -> Optional[bytes]:
+    """Download an image and return remove.bg's PNG of it"""
+    async with await download() as buffer:
+        return await services.get("removebg").remove_background(buffer)
+
+async def _send_removebg_result(
+    bot: Bot, chat_id: int, file_unique_id: Optional[str], remove: Callable[[], Awaitable[Optional[bytes]]], **kwargs
+) -> bool:
+    """Send an image with its background removed; False when remove.bg returned nothing
+
+    A result already sent for the same image is resent by file_id, skipping
+    both `remove` (the remove.bg call) and the upload.
+    """
+    keys = [f"removebg:{file_unique_id}"] if file_unique_id else []
+    send_kwargs = dict(chat_id=chat_id, caption="🖼️ **Background removed successfully!**", parse_mode=ParseMode.MARKDOWN, **kwargs)
+    if keys and await file_id_cache.send_cached(bot, keys, **send_kwargs):
+        return True
+    
+    result = await remove()
+    if not result:
+        return False
+    
+    await file_id_cache.send_photo(bot, keys + [await FileIdCache.content_key(result)], result, **send_kwargs)
+    return True
+
+def _reply_to(job: Job) -> ReplyParameters:
+    return ReplyParameters(message_id=job.payload["message_id"], allow_sending_without_reply=True)
+
+def register_jobs(bot: Bot):
+    """Register the background media jobs; call before job_queue.start()"""
+    
+    async def video_analysis_job(job: Job):
+        payload = job.payload
+        await _job_progress(bot, job, 1, 4, "📥 Downloading video...")
+        
+        async def download() -> MediaBuffer:
+            # file_id stays valid across restarts, so resumed jobs download again
+            file_obj = await bot.get_file(payload["file_id"])
+            media = await MediaBuffer.from_telegram_file(file_obj, payload["mime_type"])
+            await _job_progress(bot, job, 2, 4, "🧠 Analyzing video...")
+            return media
+        
+        analysis = await services.get("vision").analyze_upload(payload["file_unique_id"], "video", download)
+        await _job_progress(bot, job, 3, 4, "📤 Sending results...")
+        await bot.send_message(payload["chat_id"], _format_analysis("video", analysis), reply_parameters=_reply_to(job))
+        await _job_progress(bot, job, 4, 4, "✅ Done")
+    
+    async def removebg_job(job: Job):
+        payload = job.payload
+        await _job_progress(bot, job, 1, 3, "📥 Downloading image...")
+        
+        async def download() -> MediaBuffer:
+            file_obj = await bot.get_file(payload["file_id"])
+            media = await MediaBuffer.from_telegram_file(file_obj, "image/jpeg")
+            await _job_progress(bot, job, 2, 3, "✂️ Removing background...")
+            return media
+        
+        async def remove() -> Optional[bytes]:
+            # remove.bg charges per call: a retry after a failed send reuses the saved result
+            if job.checkpoint is not None:
+                return job.checkpoint
+            result = await _remove_background(download)
+            if result:
+                await job_queue.checkpoint(job, result)
+            return result
+        
+        sent = await _send_removebg_result(
+            bot, payload["chat_id"], payload.get("file_unique_id"), remove, reply_parameters=_reply_to(job)
+        )
+        if not sent:
+            await bot.send_message(
+                payload["chat_id"],
+                "Failed to remove background. Please try with a different image.",
+                reply_parameters=_reply_to(job),
+            )
+        await _job_progress(bot, job, 3, 3, "✅ Done")
+    
+    async def report_failure(job: Job, error: Exception):
+        message = error.user_message if isinstance(error, UpstreamUnavailableError) else format_error_message(job.payload["title"], str(error))
+        await _job_progress(bot, job, 0, 1, "❌ Failed")
+        await bot.send_message(job.payload["chat_id"], message, reply_parameters=_reply_to(job))
+    
+    job_queue.register("video_analysis", video_analysis_job, on_failure=report_failure)
+    job_queue.register("removebg", removebg_job, on_failure=report_failure)
+
+@track_handler
 async def vision_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle image and video uploads for analysis"""
     try:
         # Send typing indicator
         await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
         
-        file_obj = None
-        file_type = None
+        # Determine file type and media object, rejecting unusable uploads before downloading
+        media, file_type, rejection = admit_media(update.message)
         
-        # Determine file type and get file object
-        if update.message.photo:
-            file_obj = await context.bot.get_file(update.message.photo[-1].file_id)
-            file_type = "image"
-        elif update.message.video:
-            file_obj = await context.bot.get_file(update.message.video.file_id)
-            file_type = "video"
+        if rejection:
+            await update.message.reply_text(rejection)
+            return
         
-        if not file_obj:
+        if not media:
             await update.message.reply_text("Unable to process the uploaded file.")
             return
         
-        # Download file to temporary location
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            await file_obj.download_to_drive(temp_file.name)
-            temp_path = temp_file.name
+        # Check if user requested background removal. Updates from one chat are
+        # processed in order, so a /removebg always lands before the image after it.
+        waiting_chat = context.user_data.get('waiting_for_removebg') if context.user_data is not None else None
+        wants_removebg = (update.message.caption and "/removebg" in update.message.caption.lower()) or \
+            waiting_chat == update.effective_chat.id
+        if waiting_chat == update.effective_chat.id:
+            # Consume the request up front so a failed attempt doesn't leave it armed
+            context.user_data.pop('waiting_for_removebg', None)
+        
+        mime_type = "image/jpeg" if file_type == "image" else (media.mime_type or "video/mp4")
         
-        try:
-            # Check if user requested background removal
-            if (update.message.caption and "/removebg" in update.message.caption.lower()) or \
-               (hasattr(context, 'user_data') and context.user_data and context.user_data.get('waiting_for_removebg')):
-                
-                if file_type == "image":
-                    # Process background removal
-                    result_path = await removebg_service.remove_background(temp_path)
-                    
-                    if result_path:
-                        with open(result_path, 'rb') as result_file:
-                            await context.bot.send_photo(
-                                chat_id=update.effective_chat.id,
-                                photo=result_file,
-                                caption="🖼️ **Background removed successfully!**",
-                                parse_mode=ParseMode.MARKDOWN
-                            )
-                        os.unlink(result_path)
-                    else:
-                        await update.message.reply_text("Failed to remove background. Please try with a different image.")
-                else:
-                    await update.message.reply_text("Background removal only works with images, not videos.")
-                
-                # Clear the waiting state
-                if hasattr(context, 'user_data') and context.user_data:
-                    context.user_data.pop('waiting_for_removebg', None)
+        async def download() -> MediaBuffer:
+            # Download into memory (large files spill to disk)
+            file_obj = await context.bot.get_file(media.file_id)
+            return await MediaBuffer.from_telegram_file(file_obj, mime_type)
+        
+        if not wants_removebg:
+            vision_service = services.get("vision")
+            cached = vision_service.get_cached_analysis(media.file_unique_id)
+            if cached is not None:
+                await _reply_with_analysis(update, file_type, cached)
+                return
+            if file_type == "video" and job_queue.running:
+                # Video analysis takes minutes: acknowledge now and run it as a durable job
+                await _enqueue_media_job(update, "video_analysis", "🎬 Video Analysis", {
+                    "file_id": media.file_id,
+                    "file_unique_id": media.file_unique_id,
+                    "mime_type": mime_type,
+                })
+                return
             
-            else:
-                # Regular image/video analysis
-                analysis = ""
-                if file_type == "image":
-                    analysis = await vision_service.analyze_image(temp_path)
-                elif file_type == "video":
-                    analysis = await vision_service.analyze_video(temp_path)
-                
-                if analysis:
-                    # Truncate analysis if too long and escape markdown
-                    if len(analysis) > 3800:
-                        analysis = analysis[:3800] + "..."
-                    
-                    # Remove problematic markdown characters
-                    analysis = analysis.replace('*', '').replace('_', '').replace('[', '').replace(']', '')
-                    
-                    response = f"👁️ {file_type.title()} Analysis:\n\n{analysis}"
-                    await update.message.reply_text(response)
-                else:
-                    await update.message.reply_text(f"Unable to analyze the {file_type}. Please try again.")
+            # Regular image/video analysis; in-flight results skip the download
+            analysis = await vision_service.analyze_upload(media.file_unique_id, file_type, download, cache_checked=True)
+            await _reply_with_analysis(update, file_type, analysis)
+            return
         
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+        if file_type == "image":
+            # Fail fast, before queueing or downloading, when remove.bg is not configured
+            services.get("removebg")
+            if job_queue.running:
+                await _enqueue_media_job(update, "removebg", "🖼️ Background Removal", {
+                    "file_id": media.file_id,
+                    "file_unique_id": media.file_unique_id,
+                })
+                return
+            
+            if not await _send_removebg_result(
+                context.bot, update.effective_chat.id, media.file_unique_id, lambda: _remove_background(download)
+            ):
+                await update.message.reply_text("Failed to remove background. Please try with a different image.")
+        else:
+            await update.message.reply_text("Background removal only works with images, not videos.")
     
+    except UpstreamUnavailableError as e:
+        await update.message.reply_text(e.user_message)
     except Exception as e:
         logger.error(f"Error in vision handler: {e}")
         await update.message.reply_text(format_error_message("File Analysis", str(e)))
 
+@track_handler
 async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle regular text messages (fallback to Gemini AI)"""
     user_message = update.message.text
@@ -270,9 +415,18 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Send typing indicator
         await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
         
-        response = await gemini_service.generate_response(user_message)
+        if Config.GEMINI_STREAMING:
+            reply = StreamingReply(update.message, prefix="🧠 ")
+            async for chunk in services.get("gemini").generate_response_stream(user_message):
+                await reply.push(chunk)
+            await reply.finish()
+            return
+        
+        response = await services.get("gemini").generate_response(user_message)
         await update.message.reply_text(f"🧠 {response}")
         
+    except UpstreamUnavailableError as e:
+        await update.message.reply_text(e.user_message)
     except Exception as e:
         logger.error(f"Error in text handler: {e}")
         await update.message.reply_text(
@@ -1,10 +1,19 @@
 """
 Gemini AI service for text generation and analysis
 """
+import asyncio
 import logging
 import os
+import time
+from typing import AsyncIterator
 from google import genai
 from google.genai import types
+from bot.utils.errors import UpstreamUnavailableError
+from bot.utils.media import MediaBuffer
+from bot.utils.metrics import metrics
+from bot.utils.resilience import get_policy
+from bot.utils.singleflight import SingleFlight
+from config import Config
 
 logger = logging.getLogger(__name__)
 
@@ -20,69 +29,133 @@ class GeminiService:
         
         self.client = genai.Client(api_key=api_key)
         self.model = "gemini-2.5-flash"
+        
+        # Identical prompts in flight at the same time share one completion
+        self.inflight = SingleFlight("gemini")
     
     async def generate_response(self, prompt: str) -> str:
         """Generate a response using Gemini AI"""
+        return await self.inflight.do(prompt.strip(), lambda: self._generate_response(prompt))
+    
+    async def _generate_response(self, prompt: str) -> str:
+        """Single (uncoalesced) completion call"""
         try:
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=prompt
+            response = await get_policy("gemini_text").call(
+                lambda: self.client.aio.models.generate_content(
+                    model=self.model,
+                    contents=prompt
+                ),
+                endpoint="generate_response",
+                hedge=True
             )
             
             return response.text or "I'm sorry, I couldn't generate a response for that."
             
+        except UpstreamUnavailableError:
+            raise
         except Exception as e:
             logger.error(f"Error generating Gemini response: {e}")
             raise Exception(f"Failed to get AI response: {str(e)}")
     
-    async def analyze_image_with_gemini(self, image_path: str, prompt: str | None = None) -> str:
+    async def generate_response_stream(self, prompt: str) -> AsyncIterator[str]:
+        """Generate a response using Gemini AI, yielding text chunks as they arrive"""
+        async for chunk in self.inflight.stream(prompt.strip(), lambda: self._generate_response_stream(prompt)):
+            yield chunk
+    
+    async def _generate_response_stream(self, prompt: str) -> AsyncIterator[str]:
+        """Single (uncoalesced) streaming call"""
+        started = time.monotonic()
+        first_chunk = True
+        try:
+            policy = get_policy("gemini_text")
+            async with policy.guard():
+                stream = await asyncio.wait_for(
+                    self.client.aio.models.generate_content_stream(
+                        model=self.model,
+                        contents=prompt
+                    ),
+                    timeout=policy.timeout
+                )
+                
+                # The timeout above only covers opening the stream; bound the gap between chunks
+                # too, so a reply that stalls mid-way frees its bulkhead slot and the chat's queue
+                chunks = stream.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=Config.GEMINI_STREAM_IDLE_TIMEOUT)
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        raise Exception(f"Gemini stream stalled for {Config.GEMINI_STREAM_IDLE_TIMEOUT:g}s")
+                    if not chunk.text:
+                        continue
+                    if first_chunk:
+                        ttfb = time.monotonic() - started
+                        metrics.observe("gemini_ttfb_seconds", ttfb, model=self.model)
+                        logger.info(f"Gemini time to first byte: {ttfb:.3f}s")
+                        first_chunk = False
+                    yield chunk.text
+            
+        except UpstreamUnavailableError:
+            raise
+        except Exception as e:
+            logger.error(f"Error streaming Gemini response: {e}")
+            raise Exception(f"Failed to get AI response: {str(e)}")
+    
+    async def analyze_image_with_gemini(self, image: MediaBuffer, prompt: str | None = None) -> str:
         """Analyze an image using Gemini AI"""
         try:
             if not prompt:
                 prompt = "Analyze this image in detail and describe its key elements, context, and any notable aspects."
             
-            with open(image_path, "rb") as f:
-                image_bytes = f.read()
-                
-                response = self.client.models.generate_content(
+            image_bytes = await image.read()
+            
+            response = await get_policy("gemini_vision").call(
+                lambda: self.client.aio.models.generate_content(
                     model="gemini-2.5-pro",
                     contents=[
                         types.Part.from_bytes(
                             data=image_bytes,
-                            mime_type="image/jpeg",
+                            mime_type=image.mime_type,
                         ),
                         prompt,
                     ],
                 )
+            )
             
             return response.text if response.text else "Unable to analyze the image."
             
+        except UpstreamUnavailableError:
+            raise
         except Exception as e:
             logger.error(f"Error analyzing image with Gemini: {e}")
             raise Exception(f"Failed to analyze image: {str(e)}")
     
-    async def analyze_video_with_gemini(self, video_path: str, prompt: str | None = None) -> str:
+    async def analyze_video_with_gemini(self, video: MediaBuffer, prompt: str | None = None) -> str:
         """Analyze a video using Gemini AI"""
         try:
             if not prompt:
                 prompt = "Analyze this video in detail and describe its key elements, context, and any notable aspects."
             
-            with open(video_path, "rb") as f:
-                video_bytes = f.read()
-                
-                response = self.client.models.generate_content(
+            video_bytes = await video.read()
+            
+            response = await get_policy("gemini_vision").call(
+                lambda: self.client.aio.models.generate_content(
                     model="gemini-2.5-pro",
                     contents=[
                         types.Part.from_bytes(
                             data=video_bytes,
-                            mime_type="video/mp4",
+                            mime_type=video.mime_type,
                         ),
                         prompt,
                     ],
                 )
+            )
             
             return response.text if response.text else "Unable to analyze the video."
             
+        except UpstreamUnavailableError:
+            raise
         except Exception as e:
             logger.error(f"Error analyzing video with Gemini: {e}")
             raise Exception(f"Failed to analyze video: {str(e)}")
@@ -0,0 +1,97 @@
+"""
+Lazy registry of the bot's services
+"""
+import importlib
+import logging
+import os
+from typing import Any, Dict, Optional
+from bot.utils.errors import ServiceDisabledError
+
+logger = logging.getLogger(__name__)
+
+# name -> (module, class, required environment variables, services passed to the constructor)
+SERVICES = {
+    "gemini": ("bot.services.gemini_service", "GeminiService", ("GEMINI_API_KEY",), ()),
+    "youtube": ("bot.services.youtube_service", "YouTubeService", ("YOUTUBE_API_KEY",), ()),
+    "tmdb": ("bot.services.tmdb_service", "TMDBService", ("TMDB_API_KEY",), ()),
+    "removebg": ("bot.services.removebg_service", "RemoveBgService", ("REMOVEBG_API_KEY",), ()),
+    "vision": ("bot.services.vision_service", "VisionService", ("GEMINI_API_KEY",), ("gemini",)),
+}
+
+class ServiceRegistry:
+    """Build each service on first use and share it afterwards
+
+    Service modules (and the Google SDKs they import) are only loaded when a
+    service is first requested. A service whose API key is missing is
+    disabled on its own: requesting it raises ServiceDisabledError, which
+    handlers answer like any other unavailable upstream, while the rest of
+    the bot keeps working. All HTTP services share the pooled client from
+    bot.utils.http_client, and Vision reuses the Gemini service (and its
+    client) rather than building its own.
+    """
+    
+    def __init__(self, specs: Dict[str, tuple] = SERVICES):
+        self.specs = specs
+        self._instances: Dict[str, Any] = {}
+        self._disabled: Dict[str, str] = {}
+    
+    def missing_keys(self, name: str) -> list:
+        """Required environment variables that are not set for a service (and its dependencies)"""
+        _, _, keys, deps = self.specs[name]
+        missing = [key for key in keys if not os.getenv(key)]
+        for dep in deps:
+            missing += [key for key in self.missing_keys(dep) if key not in missing]
+        return missing
+    
+    def is_enabled(self, name: str) -> bool:
+        """Whether a service can be used, without building it"""
+        return name not in self._disabled and not self.missing_keys(name)
+    
+    def get(self, name: str) -> Any:
+        """Return the shared instance of a service, building it on first use"""
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        
+        if name in self._disabled:
+            raise ServiceDisabledError(name, self._disabled[name])
+        
+        missing = self.missing_keys(name)
+        if missing:
+            self._disable(name, f"{', '.join(missing)} not set")
+        
+        module_name, class_name, _, deps = self.specs[name]
+        dependencies = [self.get(dep) for dep in deps]
+        try:
+            cls = getattr(importlib.import_module(module_name), class_name)
+            instance = cls(*dependencies)
+        except (ImportError, ValueError) as e:
+            # Missing SDKs and configuration errors won't fix themselves; other errors are retried next time
+            self._disable(name, str(e))
+        
+        self._instances[name] = instance
+        logger.info(f"Initialized {name} service")
+        return instance
+    
+    def peek(self, name: str) -> Optional[Any]:
+        """Return a service only if it has already been built"""
+        return self._instances.get(name)
+    
+    def _disable(self, name: str, reason: str) -> None:
+        self._disabled[name] = reason
+        logger.warning(f"{name} service disabled: {reason}")
+        raise ServiceDisabledError(name, reason)
+    
+    def status(self) -> dict:
+        """Per-service state: ready, idle (not built yet) or disabled with a reason"""
+        status = {}
+        for name in self.specs:
+            if name in self._instances:
+                status[name] = "ready"
+            elif not self.is_enabled(name):
+                status[name] = f"disabled ({self._disabled.get(name) or ', '.join(self.missing_keys(name)) + ' not set'})"
+            else:
+                status[name] = "idle"
+        return status
+
+services = ServiceRegistry()
@@ -3,9 +3,11 @@ Remove.bg API service for background removal
 """
 import logging
 import os
-import requests
-import tempfile
 from typing import Optional
+from bot.utils.errors import UpstreamUnavailableError
+from bot.utils.http_client import HttpError, get_http_client
+from bot.utils.media import MediaBuffer
+from bot.utils.resilience import get_policy
 
 logger = logging.getLogger(__name__)
 
@@ -20,13 +22,12 @@ class RemoveBgService:
             raise ValueError("Remove.bg API key is required")
         
         self.api_url = "https://api.remove.bg/v1.0/removebg"
+        self.http = get_http_client()
     
-    async def remove_background(self, image_path: str) -> Optional[str]:
-        """Remove background from an image"""
+    async def remove_background(self, image: MediaBuffer) -> Optional[bytes]:
+        """Remove background from an image, returning the PNG result"""
         try:
-            # Read the image file
-            with open(image_path, 'rb') as image_file:
-                image_data = image_file.read()
+            image_data = await image.view()
             
             # Prepare the request
             headers = {
@@ -44,51 +45,50 @@ class RemoveBgService:
             }
             
             # Make the API request
-            response = requests.post(
-                self.api_url,
-                headers=headers,
-                files=files,
-                data=data,
-                timeout=30
-            )
-            
-            response.raise_for_status()
+            async def _post():
+                response = await self.http.post(
+                    self.api_url,
+                    headers=headers,
+                    files=files,
+                    data=data
+                )
+                response.raise_for_status()
+                return response
             
-            # Save the result to a temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as temp_file:
-                temp_file.write(response.content)
-                result_path = temp_file.name
+            response = await get_policy("removebg").call(_post)
             
-            logger.info(f"Background removed successfully, saved to: {result_path}")
-            return result_path
+            logger.info(f"Background removed successfully ({len(response.content)} bytes)")
+            return response.content
             
-        except requests.RequestException as e:
-            if hasattr(e, 'response') and e.response is not None:
-                if e.response.status_code == 402:
+        except HttpError as e:
+            if e.status is not None:
+                if e.status == 402:
                     logger.error("Remove.bg API quota exceeded")
-                    raise Exception("Background removal quota exceeded. Please try again later.")
-                elif e.response.status_code == 400:
+                    raise Exception("Background removal quota exceeded. Please try again later.") from e
+                elif e.status == 400:
                     logger.error("Invalid image format for Remove.bg")
-                    raise Exception("Invalid image format. Please use JPG, PNG, or GIF.")
+                    raise Exception("Invalid image format. Please use JPG, PNG, or GIF.") from e
                 else:
-                    logger.error(f"Remove.bg API error: {e.response.status_code} - {e.response.text}")
-                    raise Exception(f"Background removal failed: {e.response.status_code}")
+                    logger.error(f"Remove.bg API error: {e.status} - {e.text}")
+                    raise Exception(f"Background removal failed: {e.status}") from e
             else:
                 logger.error(f"Network error with Remove.bg API: {e}")
-                raise Exception("Network error during background removal")
+                raise Exception("Network error during background removal") from e
         
+        except UpstreamUnavailableError:
+            raise
         except Exception as e:
             logger.error(f"Unexpected error in background removal: {e}")
-            raise Exception(f"Background removal failed: {str(e)}")
+            raise Exception(f"Background removal failed: {str(e)}") from e
     
-    def get_account_info(self) -> dict:
+    async def get_account_info(self) -> dict:
         """Get Remove.bg account information and usage"""
         try:
             headers = {
                 'X-Api-Key': self.api_key,
             }
             
-            response = requests.get(
+            response = await self.http.get(
                 'https://api.remove.bg/v1.0/account',
                 headers=headers,
                 timeout=10
@@ -3,8 +3,13 @@ TMDB (The Movie Database) API service for movie search
 """
 import logging
 import os
-import requests
 from typing import Dict, Optional, List
+from bot.utils.cache import TTLCache
+from bot.utils.errors import UpstreamUnavailableError
+from bot.utils.http_client import HttpError, HttpResponse, get_http_client
+from bot.utils.resilience import get_policy
+from bot.utils.singleflight import SingleFlight
+from config import Config
 
 logger = logging.getLogger(__name__)
 
@@ -20,57 +25,117 @@ class TMDBService:
         
         self.base_url = "https://api.themoviedb.org/3"
         self.image_base_url = "https://image.tmdb.org/t/p/w500"
+        self.http = get_http_client()
+        
+        # Tier 1: normalized query -> movie id; tier 2: movie id -> formatted details
+        self.query_cache = TTLCache(
+            "tmdb_query", Config.TMDB_QUERY_CACHE_SIZE, Config.TMDB_QUERY_CACHE_TTL, Config.CACHE_DB_PATH
+        )
+        self.details_cache = TTLCache(
+            "tmdb_details", Config.TMDB_DETAILS_CACHE_SIZE, Config.TMDB_DETAILS_CACHE_TTL, Config.CACHE_DB_PATH
+        )
+        
+        # Concurrent identical searches share one upstream lookup
+        self.inflight = SingleFlight("tmdb")
+    
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        """Normalize a search query for cache lookups"""
+        return " ".join(query.lower().split())
     
     async def search_movie(self, query: str) -> Optional[Dict]:
         """Search for a movie and return detailed information"""
         try:
-            # Search for movies
-            search_url = f"{self.base_url}/search/movie"
-            search_params = {
-                'api_key': self.api_key,
-                'query': query,
-                'language': 'en-US',
-                'page': 1,
-                'include_adult': False
-            }
-            
-            response = requests.get(search_url, params=search_params)
-            response.raise_for_status()
-            
-            search_data = response.json()
-            
-            if not search_data.get('results'):
-                return None
-            
-            # Get the first (most relevant) result
-            movie = search_data['results'][0]
-            movie_id = movie['id']
+            return await self.inflight.do(self._normalize_query(query), lambda: self._lookup_movie(query))
             
-            # Get detailed movie information
-            details_url = f"{self.base_url}/movie/{movie_id}"
-            details_params = {
-                'api_key': self.api_key,
-                'language': 'en-US',
-                'append_to_response': 'credits,videos,similar'
-            }
-            
-            details_response = requests.get(details_url, params=details_params)
-            details_response.raise_for_status()
-            
-            details_data = details_response.json()
-            
-            # Format movie information
-            movie_info = self._format_movie_data(details_data)
-            
-            return movie_info
-            
-        except requests.RequestException as e:
+        except HttpError as e:
             logger.error(f"Error searching TMDB: {e}")
             raise Exception(f"Failed to search movies: {str(e)}")
+        except UpstreamUnavailableError:
+            raise
         except Exception as e:
             logger.error(f"Unexpected error in movie search: {e}")
             raise Exception(f"Movie search failed: {str(e)}")
     
+    async def _get(self, url: str, params: Dict, endpoint: str) -> HttpResponse:
+        """GET a TMDB endpoint under the TMDB policy, hedging slow responses (all reads are idempotent)"""
+        async def _fetch():
+            response = await self.http.get(url, params=params)
+            response.raise_for_status()
+            return response
+        
+        return await get_policy("tmdb").call(_fetch, endpoint=endpoint, hedge=True)
+    
+    async def _lookup_movie(self, query: str) -> Optional[Dict]:
+        """Resolve a query to formatted movie details"""
+        movie_id = await self._search_movie_id(query)
+        if movie_id is None:
+            return None
+        
+        return await self.get_movie_details(movie_id)
+    
+    async def _search_movie_id(self, query: str) -> Optional[int]:
+        """Resolve a query to the most relevant movie id"""
+        cache_key = self._normalize_query(query)
+        movie_id = self.query_cache.get(cache_key)
+        if movie_id is not None:
+            return movie_id
+        
+        # Search for movies
+        search_url = f"{self.base_url}/search/movie"
+        search_params = {
+            'api_key': self.api_key,
+            'query': query,
+            'language': 'en-US',
+            'page': 1,
+            'include_adult': False
+        }
+        
+        response = await self._get(search_url, search_params, "search")
+        
+        search_data = response.json()
+        
+        if not search_data.get('results'):
+            return None
+        
+        # Get the first (most relevant) result
+        movie_id = search_data['results'][0]['id']
+        self.query_cache.set(cache_key, movie_id)
+        return movie_id
+    
+    async def get_movie_details(self, movie_id: int) -> Dict:
+        """Get formatted details for a movie id"""
+        cache_key = str(movie_id)
+        movie_info = self.details_cache.get(cache_key)
+        if movie_info is not None:
+            return movie_info
+        
+        # Get detailed movie information
+        details_url = f"{self.base_url}/movie/{movie_id}"
+        details_params = {
+            'api_key': self.api_key,
+            'language': 'en-US',
+            'append_to_response': 'credits,videos,similar'
+        }
+        
+        details_response = await self._get(details_url, details_params, "details")
+        
+        details_data = details_response.json()
+        
+        # Format movie information
+        movie_info = self._format_movie_data(details_data)
+        if details_data.get('id') is not None:
+            self.details_cache.set(cache_key, movie_info)
+        
+        return movie_info
+    
+    def cache_stats(self) -> Dict:
+        """Return hit-rate counters for both cache tiers"""
+        return {
+            'query': self.query_cache.stats(),
+            'details': self.details_cache.stats(),
+        }
+    
     def _format_movie_data(self, movie_data: Dict) -> Dict:
         """Format raw TMDB data into a clean structure"""
         try:
@@ -175,8 +240,7 @@ class TMDBService:
                 'language': 'en-US'
             }
             
-            response = requests.get(url, params=params)
-            response.raise_for_status()
+            response = await self._get(url, params, "trending")
             
             data = response.json()
             movies = []
@@ -1,19 +1,28 @@
 """
 Enhanced image and video analysis service using Google Vision API and Gemini AI
 """
+import asyncio
 import logging
 import os
 import json
 import tempfile
-from bot.services.gemini_service import GeminiService
+from typing import Awaitable, Callable, Optional, Tuple
+from bot.utils.cache import TTLCache
+from bot.utils.errors import UpstreamUnavailableError
+from bot.utils.media import MediaBuffer
+from bot.utils.metrics import metrics
+from bot.utils.phash import HammingIndex, dhash, phash_available
+from bot.utils.resilience import get_policy
+from bot.utils.singleflight import SingleFlight
+from config import Config
 
 logger = logging.getLogger(__name__)
 
 class VisionService:
     """Service for image and video analysis using Google Vision API and Gemini AI"""
     
-    def __init__(self):
-        """Initialize Vision service"""
+    def __init__(self, gemini_service):
+        """Initialize Vision service on top of the shared Gemini service"""
         # Check for Google Vision API credentials
         credentials_json = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
         if credentials_json:
@@ -32,143 +41,273 @@ class VisionService:
                 # Import and initialize Vision client
                 from google.cloud import vision
                 self.vision_client = vision.ImageAnnotatorClient()
+                # The async (grpc.aio) client binds to the running loop, so it is created on first use
+                self.async_vision_client = None
                 self.vision_available = True
                 logger.info("Google Vision API initialized successfully")
                 
             except Exception as e:
                 logger.warning(f"Failed to initialize Google Vision API: {e}")
                 self.vision_client = None
+                self.async_vision_client = None
                 self.vision_available = False
         else:
             logger.info("Google Vision API credentials not provided")
             self.vision_client = None
+            self.async_vision_client = None
             self.vision_available = False
         
-        # Initialize Gemini as primary/fallback AI
-        self.gemini_service = GeminiService()
+        # Gemini is the primary/fallback AI
+        self.gemini_service = gemini_service
+        
+        # Finished analyses keyed by Telegram file_unique_id and by content hash
+        self.analysis_cache = TTLCache(
+            "vision_analysis", Config.ANALYSIS_CACHE_SIZE, Config.ANALYSIS_CACHE_TTL, Config.CACHE_DB_PATH
+        )
+        
+        # Perceptual hash -> content key, for recompressed/resized copies of known images
+        self.phash_cache = TTLCache(
+            "vision_phash", Config.PHASH_INDEX_SIZE, Config.ANALYSIS_CACHE_TTL, Config.CACHE_DB_PATH
+        )
+        self.phash_index = HammingIndex(Config.PHASH_INDEX_SIZE)
+        for key, content_key in self.phash_cache.items():
+            self.phash_index.add(int(key, 16), content_key)
+        if not phash_available():
+            logger.info("Pillow not installed, near-duplicate image matching disabled")
+        
+        # Concurrent uploads of the same Telegram file share one download and analysis
+        self.inflight = SingleFlight("vision")
         logger.info("Vision service initialized")
     
-    async def analyze_image(self, image_path: str) -> str:
+    def get_cached_analysis(self, file_unique_id: str) -> Optional[str]:
+        """Look up a previous analysis before downloading the file"""
+        return self.analysis_cache.get(f"fuid:{file_unique_id}")
+    
+    async def analyze_upload(
+        self, file_unique_id: str, file_type: str, load: Callable[[], Awaitable[MediaBuffer]], cache_checked: bool = False
+    ) -> str:
+        """Analyze a Telegram upload, downloading it via `load` only when no result is cached or in flight
+
+        Pass `cache_checked=True` when get_cached_analysis just missed, so the
+        lookup is neither repeated nor counted twice.
+        """
+        if not cache_checked:
+            cached = self.get_cached_analysis(file_unique_id)
+            if cached is not None:
+                return cached
+        
+        async def _run() -> str:
+            async with await load() as media:
+                if file_type == "video":
+                    return await self.analyze_video(media, file_unique_id)
+                return await self.analyze_image(media, file_unique_id)
+        
+        return await self.inflight.do(f"{file_type}:{file_unique_id}", _run)
+    
+    async def _cached_content_analysis(self, media: MediaBuffer, file_unique_id: Optional[str]) -> tuple:
+        """Check the content-hash tier; returns (content_key, cached_analysis)"""
+        content_key = f"sha256:{await media.sha256()}"
+        analysis = self.analysis_cache.get(content_key)
+        if analysis is not None and file_unique_id:
+            # Keep the entry's own expiry, which is short for degraded analyses
+            self.analysis_cache.set(f"fuid:{file_unique_id}", analysis, ttl=self.analysis_cache.remaining_ttl(content_key))
+        return content_key, analysis
+    
+    def _store_analysis(
+        self, content_key: str, file_unique_id: Optional[str], analysis: str, ttl: Optional[float] = None
+    ) -> None:
+        """Remember a successful analysis under every key we know for the file"""
+        self.analysis_cache.set(content_key, analysis, ttl=ttl)
+        if file_unique_id:
+            self.analysis_cache.set(f"fuid:{file_unique_id}", analysis, ttl=ttl)
+    
+    def _find_near_duplicate(self, image_hash: int) -> Optional[str]:
+        """Return the analysis of a visually near-identical image, if one is known"""
+        match = self.phash_index.find(image_hash, Config.PHASH_MAX_DISTANCE)
+        if match is None:
+            return None
+        content_key, distance = match
+        analysis = self.analysis_cache.get(content_key)
+        if analysis is not None:
+            metrics.inc("vision_near_duplicate_hits_total")
+            logger.info(f"Reusing analysis of near-duplicate image (distance {distance})")
+        return analysis
+    
+    async def analyze_image(self, image: MediaBuffer, file_unique_id: Optional[str] = None) -> str:
         """Analyze an image using Google Vision API and Gemini AI"""
+        content_key, cached = await self._cached_content_analysis(image, file_unique_id)
+        if cached is not None:
+            return cached
+        
+        image_hash = None
+        if phash_available():
+            image_hash = await asyncio.to_thread(dhash, await image.view())
+        if image_hash is not None:
+            cached = self._find_near_duplicate(image_hash)
+            if cached is not None:
+                self._store_analysis(content_key, file_unique_id, cached)
+                return cached
+        
         try:
             if self.vision_available:
                 # Use combined Google Vision + Gemini analysis
-                return await self._analyze_with_combined_vision(image_path)
+                analysis, complete = await self._analyze_with_combined_vision(image)
             else:
                 # Fallback to Gemini only
-                return await self._analyze_with_gemini_image(image_path)
+                analysis, complete = await self._analyze_with_gemini_image(image), True
+        except UpstreamUnavailableError:
+            raise
         except Exception as e:
+            # Gemini was already tried (and retried under its policy) above
             logger.error(f"Error in image analysis: {e}")
-            # Try Gemini fallback if Vision fails
-            try:
-                return await self._analyze_with_gemini_image(image_path)
-            except Exception as fallback_error:
-                logger.error(f"Fallback analysis also failed: {fallback_error}")
-                return "Unable to analyze the image. Please try again later."
+            return "Unable to analyze the image. Please try again later."
+        
+        if analysis and not analysis.startswith("Unable to analyze"):
+            if not complete:
+                # Half of the analysis failed; cache briefly so a retry soon gets the full one
+                self._store_analysis(content_key, file_unique_id, analysis, ttl=Config.DEGRADED_ANALYSIS_TTL)
+                return analysis
+            self._store_analysis(content_key, file_unique_id, analysis)
+            if image_hash is not None:
+                self.phash_index.add(image_hash, content_key)
+                self.phash_cache.set(f"{image_hash:016x}", content_key)
+        return analysis
     
-    async def analyze_video(self, video_path: str) -> str:
+    async def analyze_video(self, video: MediaBuffer, file_unique_id: Optional[str] = None) -> str:
         """Analyze a video using Gemini (Vision API doesn't support video directly)"""
+        content_key, cached = await self._cached_content_analysis(video, file_unique_id)
+        if cached is not None:
+            return cached
+        
         try:
-            return await self.gemini_service.analyze_video_with_gemini(video_path)
+            analysis = await self.gemini_service.analyze_video_with_gemini(video)
+        except UpstreamUnavailableError:
+            raise
         except Exception as e:
             logger.error(f"Error in video analysis: {e}")
             return "Unable to analyze the video. Please try again later."
+        
+        if analysis and not analysis.startswith("Unable to analyze"):
+            self._store_analysis(content_key, file_unique_id, analysis)
+        return analysis
     
 
-    async def _analyze_with_combined_vision(self, image_path: str) -> str:
-        """Analyze image using both Google Vision API and Gemini AI"""
-        try:
-            # Get Google Vision analysis
-            vision_results = await self._analyze_with_google_vision(image_path)
-            
-            # Get Gemini analysis
-            gemini_analysis = await self._analyze_with_gemini_image(image_path)
-            
-            # Combine results
-            if vision_results and gemini_analysis:
-                combined = f"{vision_results}\n\n**AI Analysis:**\n{gemini_analysis}"
-                return combined
-            elif vision_results:
-                return vision_results
-            else:
-                return gemini_analysis
-                
-        except Exception as e:
-            logger.error(f"Combined vision analysis failed: {e}")
-            # Fallback to Gemini only
-            return await self._analyze_with_gemini_image(image_path)
+    async def _analyze_with_combined_vision(self, image: MediaBuffer) -> Tuple[str, bool]:
+        """Analyze image using both Google Vision API and Gemini AI; returns (analysis, complete)"""
+        # Run Google Vision and Gemini concurrently
+        vision_results, gemini_analysis = await asyncio.gather(
+            self._analyze_with_google_vision(image),
+            self._analyze_with_gemini_image(image),
+            return_exceptions=True,
+        )
+        
+        complete = True
+        if isinstance(vision_results, BaseException):
+            logger.error(f"Google Vision analysis failed: {vision_results}")
+            vision_results = ""
+            complete = False
+        if isinstance(gemini_analysis, BaseException):
+            if not vision_results:
+                raise gemini_analysis
+            logger.error(f"Gemini part of combined analysis failed: {gemini_analysis}")
+            gemini_analysis = ""
+            complete = False
+        
+        # Combine results
+        if vision_results and gemini_analysis:
+            combined = f"{vision_results}\n\n**AI Analysis:**\n{gemini_analysis}"
+            return combined, complete
+        elif vision_results:
+            return vision_results, complete
+        else:
+            return gemini_analysis, complete
     
-    async def _analyze_with_google_vision(self, image_path: str) -> str:
-        """Analyze image using Google Vision API"""
-        try:
-            from google.cloud import vision
-            
-            # Read image file
-            with open(image_path, 'rb') as image_file:
-                content = image_file.read()
-            
-            image = vision.Image(content=content)
-            analysis_results = []
-            
-            # Label detection (objects)
+    def _get_async_vision_client(self):
+        """Create the async Vision client lazily inside the running event loop"""
+        if self.async_vision_client is None:
             try:
-                response = self.vision_client.label_detection(image=image)
-                if response.label_annotations:
-                    labels = [label.description for label in response.label_annotations[:5]]
-                    analysis_results.append(f"**Objects Detected:** {', '.join(labels)}")
-            except Exception as e:
-                logger.warning(f"Label detection failed: {e}")
-            
-            # Text detection (OCR)
-            try:
-                response = self.vision_client.text_detection(image=image)
-                if response.text_annotations:
-                    detected_text = response.text_annotations[0].description.strip()
-                    if detected_text and len(detected_text) > 3:
-                        # Limit text length
-                        if len(detected_text) > 200:
-                            detected_text = detected_text[:200] + "..."
-                        analysis_results.append(f"**Text Found:** {detected_text}")
-            except Exception as e:
-                logger.warning(f"Text detection failed: {e}")
-            
-            # Face detection
-            try:
-                response = self.vision_client.face_detection(image=image)
-                if response.face_annotations:
-                    face_count = len(response.face_annotations)
-                    analysis_results.append(f"**Faces Detected:** {face_count}")
-            except Exception as e:
-                logger.warning(f"Face detection failed: {e}")
-            
-            # Landmark detection
-            try:
-                response = self.vision_client.landmark_detection(image=image)
-                if response.landmark_annotations:
-                    landmarks = [landmark.description for landmark in response.landmark_annotations[:3]]
-                    analysis_results.append(f"**Landmarks:** {', '.join(landmarks)}")
-            except Exception as e:
-                logger.warning(f"Landmark detection failed: {e}")
-            
-            # Logo detection
-            try:
-                response = self.vision_client.logo_detection(image=image)
-                if response.logo_annotations:
-                    logos = [logo.description for logo in response.logo_annotations[:3]]
-                    analysis_results.append(f"**Logos:** {', '.join(logos)}")
+                from google.cloud import vision
+                self.async_vision_client = vision.ImageAnnotatorAsyncClient()
             except Exception as e:
-                logger.warning(f"Logo detection failed: {e}")
-            
-            if analysis_results:
-                return "\n".join(analysis_results)
-            else:
-                return ""
-                
-        except Exception as e:
-            logger.error(f"Google Vision analysis failed: {e}")
+                logger.warning(f"Async Vision client unavailable, using thread pool: {e}")
+                self.async_vision_client = False
+        return self.async_vision_client or None
+    
+    async def _annotate(self, content: bytes, feature_types: list):
+        """Run one Vision request for all features without blocking the event loop"""
+        from google.cloud import vision
+        
+        request = vision.AnnotateImageRequest(
+            image=vision.Image(content=content),
+            features=[vision.Feature(type_=feature_type) for feature_type in feature_types],
+        )
+        
+        async_client = self._get_async_vision_client()
+        
+        async def _call():
+            if async_client is not None:
+                response = await async_client.batch_annotate_images(requests=[request])
+                return response.responses[0]
+            # Thread-pool fallback for the blocking client
+            return await asyncio.to_thread(self.vision_client.annotate_image, request)
+        
+        result = await get_policy("vision_api").call(_call)
+        
+        if result.error.message:
+            raise Exception(result.error.message)
+        return result
+    
+    async def _analyze_with_google_vision(self, image: MediaBuffer) -> str:
+        """Analyze image using Google Vision API; raises on failure (an empty result means nothing was found)"""
+        from google.cloud import vision
+        
+        content = await image.read()
+        
+        feature_type = vision.Feature.Type
+        response = await self._annotate(content, [
+            feature_type.LABEL_DETECTION,
+            feature_type.TEXT_DETECTION,
+            feature_type.FACE_DETECTION,
+            feature_type.LANDMARK_DETECTION,
+            feature_type.LOGO_DETECTION,
+        ])
+        analysis_results = []
+        
+        # Labels (objects)
+        if response.label_annotations:
+            labels = [label.description for label in response.label_annotations[:5]]
+            analysis_results.append(f"**Objects Detected:** {', '.join(labels)}")
+        
+        # Text (OCR)
+        if response.text_annotations:
+            detected_text = response.text_annotations[0].description.strip()
+            if detected_text and len(detected_text) > 3:
+                # Limit text length
+                if len(detected_text) > 200:
+                    detected_text = detected_text[:200] + "..."
+                analysis_results.append(f"**Text Found:** {detected_text}")
+        
+        # Faces
+        if response.face_annotations:
+            face_count = len(response.face_annotations)
+            analysis_results.append(f"**Faces Detected:** {face_count}")
+        
+        # Landmarks
+        if response.landmark_annotations:
+            landmarks = [landmark.description for landmark in response.landmark_annotations[:3]]
+            analysis_results.append(f"**Landmarks:** {', '.join(landmarks)}")
+        
+        # Logos
+        if response.logo_annotations:
+            logos = [logo.description for logo in response.logo_annotations[:3]]
+            analysis_results.append(f"**Logos:** {', '.join(logos)}")
+        
+        if analysis_results:
+            return "\n".join(analysis_results)
+        else:
             return ""
     
-    async def _analyze_with_gemini_image(self, image_path: str) -> str:
+    async def _analyze_with_gemini_image(self, image: MediaBuffer) -> str:
         """Analyze image using Gemini AI"""
         try:
             prompt = (
@@ -179,7 +318,7 @@ class VisionService:
                 "- Any notable features, colors, or composition elements\n"
                 "- If applicable, identify any landmarks, brands, or recognizable elements"
             )
-            return await self.gemini_service.analyze_image_with_gemini(image_path, prompt)
+            return await self.gemini_service.analyze_image_with_gemini(image, prompt)
         except Exception as e:
             logger.error(f"Gemini image analysis failed: {e}")
             raise
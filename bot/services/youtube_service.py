@@ -3,11 +3,72 @@ YouTube Data API service for video search
 """
 import logging
 import os
-import requests
+from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Optional
+from bot.utils.cache import TTLCache
+from bot.utils.errors import UpstreamUnavailableError
+from bot.utils.http_client import HttpError, HttpResponse, get_http_client
+from bot.utils.metrics import metrics
+from bot.utils.resilience import get_policy
+from bot.utils.singleflight import SingleFlight
+from config import Config
 
 logger = logging.getLogger(__name__)
 
+# Quota cost of each YouTube Data API call we make
+SEARCH_COST = 100
+VIDEOS_COST = 1
+
+try:
+    from zoneinfo import ZoneInfo
+    _QUOTA_TZ = ZoneInfo("America/Los_Angeles")
+except Exception:
+    # Slim images may lack tzdata; Pacific standard time is close enough
+    _QUOTA_TZ = timezone(timedelta(hours=-8))
+
+class QuotaTracker:
+    """Track YouTube Data API units spent against the daily budget"""
+    
+    def __init__(self, daily_quota: int, reserve: float):
+        self.daily_quota = daily_quota
+        self.reserve_units = int(daily_quota * reserve)
+        self.used = 0
+        self._day = self._today()
+    
+    @staticmethod
+    def _today():
+        return datetime.now(_QUOTA_TZ).date()
+    
+    def _roll_over(self) -> None:
+        """Reset the counter when the quota day changes"""
+        today = self._today()
+        if today != self._day:
+            self._day = today
+            self.used = 0
+    
+    @property
+    def remaining(self) -> int:
+        self._roll_over()
+        return max(self.daily_quota - self.used, 0)
+    
+    def nearly_exhausted(self) -> bool:
+        """Whether we have dipped into the reserve kept for cache misses"""
+        return self.remaining <= self.reserve_units
+    
+    def can_spend(self, units: int) -> bool:
+        return self.remaining >= units
+    
+    def spend(self, units: int) -> None:
+        self._roll_over()
+        self.used += units
+        metrics.set_gauge("youtube_quota_remaining", self.remaining)
+    
+    def mark_exhausted(self) -> None:
+        """Record that the API reported the quota as exceeded"""
+        self._roll_over()
+        self.used = self.daily_quota
+        metrics.set_gauge("youtube_quota_remaining", 0)
+
 class YouTubeService:
     """Service for YouTube video search using YouTube Data API"""
     
@@ -19,79 +80,187 @@ class YouTubeService:
             raise ValueError("YouTube API key is required")
         
         self.base_url = "https://www.googleapis.com/youtube/v3"
+        self.http = get_http_client()
+        
+        self.search_cache = TTLCache(
+            "youtube_search", Config.YOUTUBE_SEARCH_CACHE_SIZE, Config.YOUTUBE_SEARCH_CACHE_TTL, Config.CACHE_DB_PATH
+        )
+        self.stats_cache = TTLCache(
+            "youtube_stats", Config.YOUTUBE_STATS_CACHE_SIZE, Config.YOUTUBE_STATS_CACHE_TTL, Config.CACHE_DB_PATH
+        )
+        self.quota = QuotaTracker(Config.YOUTUBE_DAILY_QUOTA, Config.YOUTUBE_QUOTA_RESERVE)
+        
+        # Concurrent identical searches share one upstream lookup
+        self.inflight = SingleFlight("youtube")
+    
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        """Normalize a search query for cache and in-flight lookups"""
+        return " ".join(query.lower().split())
     
     async def search_videos(self, query: str, max_results: int = 5) -> List[Dict]:
         """Search for YouTube videos"""
         try:
-            # Search for videos
-            search_url = f"{self.base_url}/search"
-            search_params = {
-                'part': 'snippet',
-                'q': query,
-                'type': 'video',
-                'maxResults': max_results,
-                'key': self.api_key,
-                'order': 'relevance'
-            }
-            
-            response = requests.get(search_url, params=search_params)
-            response.raise_for_status()
-            
-            search_data = response.json()
-            
-            if 'items' not in search_data:
-                return []
-            
-            # Get video statistics
-            video_ids = [item['id']['videoId'] for item in search_data['items']]
-            videos_url = f"{self.base_url}/videos"
-            videos_params = {
-                'part': 'statistics,contentDetails',
-                'id': ','.join(video_ids),
-                'key': self.api_key
-            }
-            
-            stats_response = requests.get(videos_url, params=videos_params)
-            stats_response.raise_for_status()
+            key = f"{self._normalize_query(query)}|{max_results}"
+            return await self.inflight.do(key, lambda: self._search(query, max_results))
             
-            stats_data = stats_response.json()
-            
-            # Combine search results with statistics
-            videos = []
-            for i, item in enumerate(search_data['items']):
-                video_id = item['id']['videoId']
-                snippet = item['snippet']
-                
-                # Find corresponding statistics
-                stats = {}
-                for stats_item in stats_data.get('items', []):
-                    if stats_item['id'] == video_id:
-                        stats = stats_item['statistics']
-                        break
-                
-                video_info = {
-                    'video_id': video_id,
-                    'title': snippet['title'],
-                    'channel': snippet['channelTitle'],
-                    'description': snippet['description'][:200] + '...' if len(snippet['description']) > 200 else snippet['description'],
-                    'published_at': snippet['publishedAt'],
-                    'thumbnail': snippet['thumbnails']['medium']['url'],
-                    'views': self._format_number(stats.get('viewCount', '0')),
-                    'likes': self._format_number(stats.get('likeCount', '0')),
-                    'comments': self._format_number(stats.get('commentCount', '0'))
-                }
-                
-                videos.append(video_info)
-            
-            return videos
-            
-        except requests.RequestException as e:
+        except HttpError as e:
             logger.error(f"Error searching YouTube videos: {e}")
             raise Exception(f"Failed to search YouTube: {str(e)}")
+        except UpstreamUnavailableError:
+            raise
         except Exception as e:
             logger.error(f"Unexpected error in YouTube search: {e}")
             raise Exception(f"YouTube search failed: {str(e)}")
     
+    async def _search(self, query: str, max_results: int) -> List[Dict]:
+        """Run a search and attach view/like/comment counts"""
+        items = await self._search_items(query, max_results)
+        if not items:
+            return []
+        
+        stats_by_id = await self._get_statistics([item['video_id'] for item in items])
+        
+        # Combine search results with statistics
+        videos = []
+        for item in items:
+            stats = stats_by_id.get(item['video_id'], {})
+            video_info = dict(item)
+            video_info['views'] = self._format_number(stats.get('viewCount', '0'))
+            video_info['likes'] = self._format_number(stats.get('likeCount', '0'))
+            video_info['comments'] = self._format_number(stats.get('commentCount', '0'))
+            videos.append(video_info)
+        
+        return videos
+    
+    async def _search_items(self, query: str, max_results: int) -> List[Dict]:
+        """Return snippet data for a search, from cache when possible"""
+        cache_key = f"{self._normalize_query(query)}|{max_results}"
+        items = self.search_cache.get(cache_key)
+        if items is not None:
+            return items
+        
+        # Near the end of the daily budget, prefer slightly stale results over spending 100 units
+        if self.quota.nearly_exhausted() or not self.quota.can_spend(SEARCH_COST):
+            stale = self.search_cache.get(cache_key, allow_stale=True)
+            if stale is not None:
+                logger.info(f"YouTube quota low ({self.quota.remaining} left), serving stale results")
+                return stale
+            if not self.quota.can_spend(SEARCH_COST):
+                raise Exception("YouTube daily quota exhausted. Please try again later.")
+        
+        # Search for videos
+        search_url = f"{self.base_url}/search"
+        search_params = {
+            'part': 'snippet',
+            'q': query,
+            'type': 'video',
+            'maxResults': max_results,
+            'key': self.api_key,
+            'order': 'relevance'
+        }
+        
+        try:
+            response = await self._get(search_url, search_params, SEARCH_COST, "search")
+        except HttpError as e:
+            if self._is_quota_error(e):
+                self.quota.mark_exhausted()
+                stale = self.search_cache.get(cache_key, allow_stale=True)
+                if stale is not None:
+                    return stale
+            raise
+        
+        search_data = response.json()
+        
+        items = []
+        for item in search_data.get('items', []):
+            snippet = item['snippet']
+            items.append({
+                'video_id': item['id']['videoId'],
+                'title': snippet['title'],
+                'channel': snippet['channelTitle'],
+                'description': snippet['description'][:200] + '...' if len(snippet['description']) > 200 else snippet['description'],
+                'published_at': snippet['publishedAt'],
+                'thumbnail': snippet['thumbnails']['medium']['url'],
+            })
+        
+        self.search_cache.set(cache_key, items)
+        return items
+    
+    async def _get_statistics(self, video_ids: List[str]) -> Dict[str, Dict]:
+        """Return statistics indexed by video id, fetching only ids missing from the cache"""
+        stats_by_id = {}
+        missing = []
+        for video_id in video_ids:
+            stats = self.stats_cache.get(video_id)
+            if stats is not None:
+                stats_by_id[video_id] = stats
+            else:
+                missing.append(video_id)
+        
+        if not missing:
+            return stats_by_id
+        
+        if self.quota.nearly_exhausted() or not self.quota.can_spend(VIDEOS_COST):
+            for video_id in missing:
+                stale = self.stats_cache.get(video_id, allow_stale=True)
+                if stale is not None:
+                    stats_by_id[video_id] = stale
+            if not self.quota.can_spend(VIDEOS_COST):
+                return stats_by_id
+        
+        # Get video statistics
+        videos_url = f"{self.base_url}/videos"
+        videos_params = {
+            'part': 'statistics,contentDetails',
+            'id': ','.join(missing),
+            'key': self.api_key
+        }
+        
+        try:
+            stats_response = await self._get(videos_url, videos_params, VIDEOS_COST, "videos")
+        except HttpError as e:
+            if self._is_quota_error(e):
+                self.quota.mark_exhausted()
+                return stats_by_id
+            raise
+        
+        stats_data = stats_response.json()
+        
+        for stats_item in stats_data.get('items', []):
+            stats = stats_item.get('statistics', {})
+            stats_by_id[stats_item['id']] = stats
+            self.stats_cache.set(stats_item['id'], stats)
+        
+        return stats_by_id
+    
+    async def _get(self, url: str, params: Dict, cost: int, endpoint: str) -> HttpResponse:
+        """GET a Data API endpoint under the YouTube policy, charging quota for every attempt
+
+        Slow calls are hedged unless the daily quota is running low, since each
+        hedge is charged like any other request.
+        """
+        async def _fetch():
+            self.quota.spend(cost)
+            response = await self.http.get(url, params=params)
+            response.raise_for_status()
+            return response
+        
+        return await get_policy("youtube").call(_fetch, endpoint=endpoint, hedge=not self.quota.nearly_exhausted())
+    
+    @staticmethod
+    def _is_quota_error(error: HttpError) -> bool:
+        """Whether an API error means the daily quota is used up"""
+        return error.status == 403 and 'quotaExceeded' in error.text
+    
+    def cache_stats(self) -> Dict:
+        """Return cache hit rates and remaining quota"""
+        return {
+            'search': self.search_cache.stats(),
+            'statistics': self.stats_cache.stats(),
+            'quota_remaining': self.quota.remaining,
+        }
+    
     def _format_number(self, num_str: str) -> str:
         """Format large numbers with K, M, B suffixes"""
         try:
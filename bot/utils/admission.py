@@ -0,0 +1,66 @@
+"""
+Pre-download admission checks for uploaded media, based on Telegram metadata
+"""
+import logging
+import mimetypes
+from typing import Optional, Tuple
+from telegram import Message
+from bot.utils.helpers import (
+    format_file_size, is_supported_video_format, validate_file_size
+)
+from bot.utils.metrics import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def _mime_matches(mime_type: Optional[str], file_name: Optional[str], checker) -> bool:
+    """Check a mime type / file name against a supported-extension predicate"""
+    if file_name and checker(file_name):
+        return True
+    if mime_type and any(checker(f"file{ext}") for ext in mimetypes.guess_all_extensions(mime_type)):
+        return True
+    # Without any metadata to judge by, let the upload through
+    return not mime_type and not file_name
+
+def admit_media(message: Message) -> Tuple[Optional[object], Optional[str], Optional[str]]:
+    """Pick the media object to download, or explain why the upload is rejected
+
+    Returns (media, file_type, rejection_message). Oversized photos are routed
+    to the largest resolution Telegram generated that fits under
+    Config.MAX_FILE_SIZE; oversized or unsupported videos are rejected. Bytes
+    we avoid downloading are counted in `media_avoided_bytes_total`.
+    """
+    max_size = Config.MAX_FILE_SIZE
+
+    if message.photo:
+        largest = message.photo[-1]
+        for photo in reversed(message.photo):
+            if photo.file_size is None or validate_file_size(photo.file_size, max_size):
+                if photo is not largest and largest.file_size:
+                    metrics.inc("media_avoided_bytes_total", largest.file_size - (photo.file_size or 0), reason="downscaled")
+                    logger.info(f"Routing oversized photo to a {photo.width}x{photo.height} rendition")
+                return photo, "image", None
+
+        metrics.inc("media_avoided_bytes_total", largest.file_size or 0, reason="too_large")
+        return None, "image", (
+            f"This image is too large ({format_file_size(largest.file_size or 0)}). "
+            f"The maximum size is {format_file_size(max_size)}."
+        )
+
+    if message.video:
+        video = message.video
+        if video.file_size and not validate_file_size(video.file_size, max_size):
+            metrics.inc("media_avoided_bytes_total", video.file_size, reason="too_large")
+            return None, "video", (
+                f"This video is too large ({format_file_size(video.file_size)}). "
+                f"The maximum size is {format_file_size(max_size)}."
+            )
+        if not _mime_matches(video.mime_type, video.file_name, is_supported_video_format):
+            metrics.inc("media_avoided_bytes_total", video.file_size or 0, reason="unsupported_format")
+            return None, "video", (
+                "This video format is not supported. "
+                f"Supported formats: {', '.join(ext.lstrip('.').upper() for ext in Config.SUPPORTED_VIDEO_FORMATS)}"
+            )
+        return video, "video", None
+
+    return None, None, None
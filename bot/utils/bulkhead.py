@@ -0,0 +1,105 @@
+"""
+Per-backend concurrency bulkheads with bounded wait queues and load shedding
+"""
+import asyncio
+import logging
+import time
+from typing import Dict
+from bot.utils.errors import UpstreamUnavailableError
+from bot.utils.metrics import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class BulkheadFullError(UpstreamUnavailableError):
+    """Raised when a request is shed because a backend is saturated"""
+
+    user_message = "⏳ I'm handling a lot of requests right now. Please try again in a minute."
+
+    def __init__(self, name: str, reason: str):
+        super().__init__(f"{name} is busy ({reason})")
+        self.name = name
+        self.reason = reason
+
+class Bulkhead:
+    """Limit concurrent calls to one upstream
+
+    At most `max_concurrent` calls run at once and at most `max_queue` wait
+    for a slot. A waiter that has not been admitted within `queue_timeout`
+    seconds, or that arrives to a full queue, is shed with BulkheadFullError.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._waiting = 0
+        self._active = 0
+        self._shed = 0
+
+    def _publish(self) -> None:
+        metrics.set_gauge("bulkhead_queue_depth", self._waiting, backend=self.name)
+        metrics.set_gauge("bulkhead_in_flight", self._active, backend=self.name)
+
+    def _reject(self, reason: str) -> BulkheadFullError:
+        self._shed += 1
+        metrics.inc("bulkhead_shed_total", backend=self.name, reason=reason)
+        logger.warning(f"Shedding {self.name} request: {reason}")
+        return BulkheadFullError(self.name, reason)
+
+    async def __aenter__(self) -> "Bulkhead":
+        if not self._semaphore.locked():
+            # Free slot: acquire() returns without suspending
+            await self._semaphore.acquire()
+        else:
+            if self._waiting >= self.max_queue:
+                raise self._reject("queue full")
+
+            started = time.monotonic()
+            self._waiting += 1
+            self._publish()
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise self._reject("queue timeout") from None
+            finally:
+                self._waiting -= 1
+                metrics.observe("bulkhead_wait_seconds", time.monotonic() - started, backend=self.name)
+
+        self._active += 1
+        self._publish()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._active -= 1
+        self._semaphore.release()
+        self._publish()
+
+    def has_capacity(self) -> bool:
+        """Whether a call could start right now without queueing"""
+        return not self._semaphore.locked()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self._active,
+            "queued": self._waiting,
+            "shed": self._shed,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+        }
+
+_bulkheads: Dict[str, Bulkhead] = {}
+
+def get_bulkhead(name: str) -> Bulkhead:
+    """Return the bulkhead for a backend, creating it from Config.BULKHEADS on first use"""
+    bulkhead = _bulkheads.get(name)
+    if bulkhead is None:
+        bulkhead = _bulkheads[name] = Bulkhead(name, *Config.BULKHEADS[name])
+    return bulkhead
+
+def bulkhead_stats() -> dict:
+    """Stats for every bulkhead created so far"""
+    return {name: bulkhead.stats() for name, bulkhead in _bulkheads.items()}
@@ -0,0 +1,211 @@
+"""
+Bounded TTL/LRU cache with hit-rate counters and optional SQLite persistence
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from bot.utils.metrics import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Seconds between purges of long-expired rows from the backing store
+PURGE_INTERVAL = 3600
+
+class TTLCache:
+    """In-process LRU cache whose entries expire after a TTL
+
+    Expired entries are kept until evicted so callers can opt into stale reads
+    (e.g. when an upstream quota is exhausted). When `persist_path` is given,
+    entries are written to a SQLite table and reloaded on start-up; values
+    must then be JSON-serialisable. Writes are batched and run in a worker
+    thread every Config.CACHE_FLUSH_INTERVAL seconds so the event loop never
+    waits on disk, and rows that expired more than a TTL ago are purged.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float, persist_path: Optional[str] = None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "stale_hits": 0, "evictions": 0}
+        self._db: Optional[sqlite3.Connection] = None
+        # Writes not yet flushed: key -> (JSON value, expiry), or None to delete
+        self._pending: Dict[str, Optional[Tuple[str, float]]] = {}
+        self._flush_scheduled = False
+        self._db_lock = threading.Lock()
+        self._last_purge = 0.0
+
+        if persist_path:
+            try:
+                self._open_db(persist_path)
+            except sqlite3.Error as e:
+                logger.warning(f"Cache '{name}' persistence disabled: {e}")
+                self._db = None
+
+    def _open_db(self, path: str) -> None:
+        """Open the backing store and load the most recent entries"""
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            "cache TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL, "
+            "PRIMARY KEY (cache, key))"
+        )
+        rows = self._db.execute(
+            "SELECT key, value, expires_at FROM cache_entries WHERE cache = ? ORDER BY expires_at DESC LIMIT ?",
+            (self.name, self.maxsize),
+        ).fetchall()
+        for key, value, expires_at in reversed(rows):
+            self._data[key] = (json.loads(value), expires_at)
+        # Rows beyond maxsize would never be loaded again
+        self._db.execute(
+            "DELETE FROM cache_entries WHERE cache = ? AND key NOT IN "
+            "(SELECT key FROM cache_entries WHERE cache = ? ORDER BY expires_at DESC LIMIT ?)",
+            (self.name, self.name, self.maxsize),
+        )
+        self._purge_expired()
+        logger.info(f"Cache '{self.name}' loaded {len(rows)} entries from {path}")
+
+    def _purge_expired(self) -> None:
+        """Delete rows that expired more than a TTL ago (too old even for stale reads)"""
+        self._last_purge = time.time()
+        self._db.execute(
+            "DELETE FROM cache_entries WHERE cache = ? AND expires_at < ?", (self.name, self._last_purge - self.ttl)
+        )
+
+    def _queue_write(self, key: str, row: Optional[Tuple[str, float]]) -> None:
+        """Queue a write for the next batch, scheduling a flush if none is pending"""
+        self._pending[key] = row
+        if self._flush_scheduled:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop to protect (start-up, scripts): write now
+            self._write(self._take_pending())
+            return
+        self._flush_scheduled = True
+        loop.call_later(Config.CACHE_FLUSH_INTERVAL, self._flush_in_thread, loop)
+
+    def _take_pending(self) -> Dict[str, Optional[Tuple[str, float]]]:
+        batch, self._pending = self._pending, {}
+        return batch
+
+    def _flush_in_thread(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._flush_scheduled = False
+        loop.run_in_executor(None, self._write, self._take_pending())
+
+    def _write(self, batch: Dict[str, Optional[Tuple[str, float]]]) -> None:
+        """Apply a batch of writes in one transaction (runs in a worker thread)"""
+        upserts = [(self.name, key, row[0], row[1]) for key, row in batch.items() if row is not None]
+        deletes = [(self.name, key) for key, row in batch.items() if row is None]
+        with self._db_lock:
+            try:
+                self._db.execute("BEGIN")
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO cache_entries (cache, key, value, expires_at) VALUES (?, ?, ?, ?)", upserts
+                )
+                self._db.executemany("DELETE FROM cache_entries WHERE cache = ? AND key = ?", deletes)
+                if time.time() - self._last_purge > PURGE_INTERVAL:
+                    self._purge_expired()
+                self._db.execute("COMMIT")
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to persist {len(batch)} entries of cache '{self.name}': {e}")
+                if self._db.in_transaction:
+                    self._db.execute("ROLLBACK")
+
+    def flush(self) -> None:
+        """Write pending entries now (e.g. before shutdown)"""
+        if self._db is not None and self._pending:
+            self._write(self._take_pending())
+
+    def _record(self, result: str) -> None:
+        metrics.inc("cache_requests_total", cache=self.name, result=result)
+        lookups = self._stats["hits"] + self._stats["misses"] + self._stats["stale_hits"]
+        metrics.set_gauge("cache_hit_ratio", (self._stats["hits"] + self._stats["stale_hits"]) / lookups, cache=self.name)
+        metrics.set_gauge("cache_entries", len(self._data), cache=self.name)
+
+    def get(self, key: str, default: Any = None, allow_stale: bool = False) -> Any:
+        """Return a cached value, or `default` when missing or expired"""
+        entry = self._data.get(key)
+        if entry is None:
+            self._stats["misses"] += 1
+            self._record("miss")
+            return default
+
+        value, expires_at = entry
+        if expires_at < time.time():
+            if allow_stale:
+                self._stats["stale_hits"] += 1
+                self._record("stale")
+                self._data.move_to_end(key)
+                return value
+            self._stats["misses"] += 1
+            self._record("miss")
+            return default
+
+        self._stats["hits"] += 1
+        self._record("hit")
+        self._data.move_to_end(key)
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry[1] >= time.time()
+
+    def remaining_ttl(self, key: str) -> Optional[float]:
+        """Seconds until an entry expires (None when missing or already expired)"""
+        entry = self._data.get(key)
+        if entry is None or entry[1] < time.time():
+            return None
+        return entry[1] - time.time()
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Store a value, evicting the least recently used entries beyond `maxsize`"""
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+
+        evicted = []
+        while len(self._data) > self.maxsize:
+            old_key, _ = self._data.popitem(last=False)
+            evicted.append(old_key)
+        self._stats["evictions"] += len(evicted)
+
+        if self._db is not None:
+            try:
+                # Serialise now: the value may be mutated before the batch is written
+                self._queue_write(key, (json.dumps(value), expires_at))
+            except (TypeError, ValueError) as e:
+                logger.warning(f"Failed to persist cache entry '{self.name}:{key}': {e}")
+            for old_key in evicted:
+                self._queue_write(old_key, None)
+
+    def delete(self, key: str) -> None:
+        """Remove an entry if present"""
+        self._data.pop(key, None)
+        if self._db is not None:
+            self._queue_write(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def items(self):
+        """Return (key, value) pairs that have not expired"""
+        now = time.time()
+        return [(key, value) for key, (value, expires_at) in self._data.items() if expires_at >= now]
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and the current size"""
+        stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"] + stats["stale_hits"]
+        stats["size"] = len(self._data)
+        stats["hit_ratio"] = round((stats["hits"] + stats["stale_hits"]) / lookups, 3) if lookups else 0.0
+        return stats
@@ -0,0 +1,22 @@
+"""
+Shared exception types for upstream service calls
+"""
+
+class UpstreamUnavailableError(Exception):
+    """Raised when a request is refused before (or instead of) reaching an upstream
+
+    Services let these propagate unchanged so handlers can answer with
+    `user_message` instead of a generic error.
+    """
+
+    user_message = "⚠️ This feature is temporarily unavailable. Please try again in a minute."
+
+class ServiceDisabledError(UpstreamUnavailableError):
+    """Raised when a feature's service cannot be built, e.g. its API key is missing"""
+
+    user_message = "🔒 This feature is not configured on this bot."
+
+    def __init__(self, name: str, reason: str):
+        super().__init__(f"{name} service disabled: {reason}")
+        self.name = name
+        self.reason = reason
@@ -0,0 +1,103 @@
+"""
+Cache of Telegram file_ids for photos the bot has already sent
+"""
+import asyncio
+import hashlib
+import logging
+from typing import Any, List, Optional
+from telegram import Bot, Message
+from telegram.error import BadRequest
+from bot.utils.cache import TTLCache
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class FileIdCache:
+    """Reuse the file_id Telegram assigns to a photo on its first send
+
+    Sending a URL makes Telegram fetch it again, and sending bytes uploads
+    them again; sending a known file_id does neither. Entries are keyed by
+    whatever identifies the photo before it is sent (its URL, a hash of its
+    bytes, or the input it was derived from) and live in a bounded TTLCache,
+    created on first use and persisted to SQLite when `persist_path` is set.
+    A file_id Telegram no longer accepts is dropped and the photo is sent in
+    full again.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, persist_path: Optional[str] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.persist_path = persist_path
+        self._cache: Optional[TTLCache] = None
+
+    @property
+    def cache(self) -> TTLCache:
+        if self._cache is None:
+            self._cache = TTLCache("telegram_file_ids", self.maxsize, self.ttl, self.persist_path)
+        return self._cache
+
+    @staticmethod
+    def url_key(url: str) -> str:
+        return f"url:{url}"
+
+    @staticmethod
+    async def content_key(data: bytes) -> str:
+        # Hashing a large image would stall the event loop
+        digest = await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+        return f"sha256:{digest}"
+
+    @staticmethod
+    def _is_stale(error: BadRequest) -> bool:
+        """Whether Telegram rejected the file_id itself (rather than, say, the caption)"""
+        message = error.message.lower()
+        return "wrong file identifier" in message or "file reference" in message
+
+    def get(self, keys: List[str]) -> Optional[str]:
+        for key in keys:
+            file_id = self.cache.get(key)
+            if file_id is not None:
+                return file_id
+        return None
+
+    def remember(self, keys: List[str], message: Message) -> None:
+        """Record the file_id of the photo in a sent message under every key"""
+        if message is None or not message.photo:
+            return
+        # All sizes share the upload; sending the largest one's file_id resends the original
+        file_id = message.photo[-1].file_id
+        for key in keys:
+            self.cache.set(key, file_id)
+
+    async def send_cached(self, bot: Bot, keys: List[str], **kwargs: Any) -> Optional[Message]:
+        """Send a photo by its cached file_id; None when nothing usable is cached"""
+        file_id = self.get(keys)
+        if file_id is None:
+            return None
+        try:
+            return await bot.send_photo(photo=file_id, **kwargs)
+        except BadRequest as e:
+            if not self._is_stale(e):
+                raise
+            logger.warning(f"Cached file_id for {keys[0]} rejected, sending in full: {e}")
+            for key in keys:
+                self.cache.delete(key)
+            return None
+
+    async def send_photo(self, bot: Bot, keys: List[str], photo: Any, **kwargs: Any) -> Message:
+        """Send `photo`, reusing a cached file_id for any of `keys` when there is one"""
+        message = await self.send_cached(bot, keys, **kwargs)
+        if message is not None:
+            return message
+        message = await bot.send_photo(photo=photo, **kwargs)
+        self.remember(keys, message)
+        return message
+
+    def flush(self) -> None:
+        """Write pending entries now; a cache never used has nothing to write"""
+        if self._cache is not None:
+            self._cache.flush()
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+file_id_cache = FileIdCache(Config.FILE_ID_CACHE_SIZE, Config.FILE_ID_CACHE_TTL, Config.FILE_ID_CACHE_DB_PATH)
@@ -4,33 +4,28 @@ Utility functions for the Telegram bot
 import logging
 import os
 import tempfile
-import aiohttp
 from typing import Optional
+from bot.utils.http_client import get_http_client
+from config import Config
 
 logger = logging.getLogger(__name__)
 
 async def download_file(url: str, filename: Optional[str] = None) -> str:
     """Download a file from URL to temporary location"""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                response.raise_for_status()
-                
-                # Create temporary file
-                if filename:
-                    temp_path = os.path.join(tempfile.gettempdir(), filename)
-                else:
-                    temp_file = tempfile.NamedTemporaryFile(delete=False)
-                    temp_path = temp_file.name
-                    temp_file.close()
-                
-                # Write content to file
-                with open(temp_path, 'wb') as f:
-                    async for chunk in response.content.iter_chunked(1024):
-                        f.write(chunk)
-                
-                logger.info(f"Downloaded file to: {temp_path}")
-                return temp_path
+        # Create temporary file
+        if filename:
+            temp_path = os.path.join(tempfile.gettempdir(), filename)
+        else:
+            temp_file = tempfile.NamedTemporaryFile(delete=False)
+            temp_path = temp_file.name
+            temp_file.close()
+        
+        # Stream content to file through the shared connection pool
+        await get_http_client().download_to(url, temp_path)
+        
+        logger.info(f"Downloaded file to: {temp_path}")
+        return temp_path
                 
     except Exception as e:
         logger.error(f"Error downloading file from {url}: {e}")
@@ -45,7 +40,7 @@ def format_error_message(service_name: str, error_message: str) -> str:
         f"Please try again later or contact support if the problem persists."
     )
 
-def validate_file_size(file_size: int, max_size: int = 20 * 1024 * 1024) -> bool:
+def validate_file_size(file_size: int, max_size: int = Config.MAX_FILE_SIZE) -> bool:
     """Validate if file size is within limits"""
     return file_size <= max_size
 
@@ -55,13 +50,11 @@ def get_file_extension(filename: str) -> str:
 
 def is_supported_image_format(filename: str) -> bool:
     """Check if file is a supported image format"""
-    supported_formats = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']
-    return get_file_extension(filename) in supported_formats
+    return get_file_extension(filename) in Config.SUPPORTED_IMAGE_FORMATS
 
 def is_supported_video_format(filename: str) -> bool:
     """Check if file is a supported video format"""
-    supported_formats = ['.mp4', '.avi', '.mov', '.mkv', '.wmv']
-    return get_file_extension(filename) in supported_formats
+    return get_file_extension(filename) in Config.SUPPORTED_VIDEO_FORMATS
 
 def truncate_text(text: str, max_length: int = 4000) -> str:
     """Truncate text to fit Telegram message limits"""
@@ -0,0 +1,246 @@
+"""
+Shared non-blocking HTTP client with a process-wide keep-alive connection pool
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Optional, Union
+from urllib.parse import urlparse
+
+import aiohttp
+
+from config import Config
+from bot.utils.metrics import metrics
+from bot.utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+class HttpError(Exception):
+    """Raised for transport failures and non-2xx responses"""
+
+    def __init__(self, message: str, status: Optional[int] = None, text: str = ""):
+        super().__init__(message)
+        self.status = status
+        self.text = text
+
+class HttpResponse:
+    """Fully-read HTTP response, shaped like the parts of `requests.Response` we use"""
+
+    def __init__(self, url: str, status: int, headers: Dict[str, str], content: bytes):
+        self.url = url
+        self.status_code = status
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+    def raise_for_status(self) -> None:
+        """Raise HttpError for 4xx/5xx responses"""
+        if self.status_code >= 400:
+            raise HttpError(f"{self.status_code} error for {self.url}", status=self.status_code, text=self.text)
+
+def _normalize_params(params: Optional[Dict[str, Any]]) -> Optional[Dict[str, str]]:
+    """Convert query parameters to strings (aiohttp rejects bools and ints in some versions)"""
+    if params is None:
+        return None
+    normalized = {}
+    for key, value in params.items():
+        if isinstance(value, bool):
+            normalized[key] = "true" if value else "false"
+        else:
+            normalized[key] = str(value)
+    return normalized
+
+class HttpClient:
+    """Async HTTP client backed by a single pooled aiohttp session"""
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stats = {
+            "requests": 0,
+            "errors": 0,
+            "pool_hits": 0,
+            "pool_misses": 0,
+            "pool_waits": 0,
+            "pool_wait_seconds": 0.0,
+            "bytes_downloaded": 0,
+            "bytes_uploaded": 0,
+        }
+
+    def _build_trace_config(self) -> aiohttp.TraceConfig:
+        """Hook connection pool events to collect hit/miss and wait-time counters"""
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_reuse(session, ctx, params):
+            self._stats["pool_hits"] += 1
+            metrics.inc("http_pool_connections_total", result="hit")
+
+        async def on_create(session, ctx, params):
+            self._stats["pool_misses"] += 1
+            metrics.inc("http_pool_connections_total", result="miss")
+
+        async def on_queued_start(session, ctx, params):
+            ctx.queued_at = time.monotonic()
+
+        async def on_queued_end(session, ctx, params):
+            waited = time.monotonic() - getattr(ctx, "queued_at", time.monotonic())
+            self._stats["pool_waits"] += 1
+            self._stats["pool_wait_seconds"] += waited
+            metrics.observe("http_pool_wait_seconds", waited)
+
+        trace_config.on_connection_reuseconn.append(on_reuse)
+        trace_config.on_connection_create_start.append(on_create)
+        trace_config.on_connection_queued_start.append(on_queued_start)
+        trace_config.on_connection_queued_end.append(on_queued_end)
+        return trace_config
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Create the pooled session lazily, bound to the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._session is not None and not self._session.closed and self._loop is not loop:
+            await self._close_stale(self._session, self._loop)
+        if self._session is None or self._session.closed or self._loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=Config.HTTP_POOL_LIMIT,
+                limit_per_host=Config.HTTP_POOL_LIMIT_PER_HOST,
+                keepalive_timeout=Config.HTTP_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=Config.HTTP_DNS_CACHE_TTL,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=Config.HTTP_TIMEOUT),
+                trace_configs=[self._build_trace_config()],
+            )
+            self._loop = loop
+            logger.info("HTTP connection pool created")
+        return self._session
+
+    @staticmethod
+    async def _close_stale(session: aiohttp.ClientSession, loop: Optional[asyncio.AbstractEventLoop]) -> None:
+        """Close a session left over from another event loop (e.g. an earlier asyncio.run)"""
+        try:
+            if loop is not None and loop.is_running():
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(session.close(), loop))
+            else:
+                await session.close()
+        except Exception as e:
+            # Its loop is gone; the sockets went with it
+            logger.debug(f"Could not close stale HTTP session: {e!r}")
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        params: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        data: Optional[Dict[str, Any]] = None,
+        files: Optional[Dict[str, Union[bytes, memoryview]]] = None,
+        timeout: Optional[float] = None,
+    ) -> HttpResponse:
+        """Send a request through the shared pool and read the full body"""
+        session = await self._get_session()
+
+        body: Any = data
+        uploaded = 0
+        if files:
+            form = aiohttp.FormData()
+            for name, value in (data or {}).items():
+                form.add_field(name, str(value))
+            for name, content in files.items():
+                form.add_field(name, content, filename=name)
+                uploaded += len(content)
+            body = form
+
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+        self._stats["requests"] += 1
+        try:
+            with span(f"http.{method}", host=urlparse(url).hostname):
+                async with session.request(
+                    method,
+                    url,
+                    params=_normalize_params(params),
+                    headers=headers,
+                    data=body,
+                    timeout=request_timeout,
+                ) as response:
+                    content = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self._stats["errors"] += 1
+            raise HttpError(f"Request to {url} failed: {e!r}") from e
+
+        self._stats["bytes_uploaded"] += uploaded
+        self._stats["bytes_downloaded"] += len(content)
+        metrics.inc("http_bytes_total", uploaded, direction="upload")
+        metrics.inc("http_bytes_total", len(content), direction="download")
+        return HttpResponse(str(response.url), response.status, dict(response.headers), content)
+
+    async def get(self, url: str, **kwargs) -> HttpResponse:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> HttpResponse:
+        return await self.request("POST", url, **kwargs)
+
+    async def warm(self, url: str, timeout: Optional[float] = None) -> None:
+        """Open a pooled connection (DNS, TCP and TLS) to a host ahead of real traffic"""
+        await self.request("HEAD", url, timeout=timeout)
+
+    async def download_to(self, url: str, path: str, chunk_size: int = 64 * 1024) -> int:
+        """Stream a response body to a local file, returning the number of bytes written"""
+        session = await self._get_session()
+        self._stats["requests"] += 1
+        written = 0
+        try:
+            async with session.get(url) as response:
+                if response.status >= 400:
+                    raise HttpError(f"{response.status} error for {url}", status=response.status)
+                # File I/O happens in worker threads so a slow disk never stalls the loop
+                f = await asyncio.to_thread(open, path, "wb")
+                try:
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        await asyncio.to_thread(f.write, chunk)
+                        written += len(chunk)
+                finally:
+                    await asyncio.to_thread(f.close)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self._stats["errors"] += 1
+            raise HttpError(f"Download from {url} failed: {e!r}") from e
+
+        self._stats["bytes_downloaded"] += written
+        metrics.inc("http_bytes_total", written, direction="download")
+        return written
+
+    def stats(self) -> dict:
+        """Return pool counters for status/metrics endpoints"""
+        stats = dict(self._stats)
+        total = stats["pool_hits"] + stats["pool_misses"]
+        stats["pool_hit_ratio"] = round(stats["pool_hits"] / total, 3) if total else 0.0
+        stats["pool_wait_seconds"] = round(stats["pool_wait_seconds"], 6)
+        return stats
+
+    async def close(self) -> None:
+        """Close the pooled session"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+_http_client: Optional[HttpClient] = None
+
+def get_http_client() -> HttpClient:
+    """Return the process-wide HTTP client"""
+    global _http_client
+    if _http_client is None:
+        _http_client = HttpClient()
+    return _http_client
+
+async def close_http_client() -> None:
+    """Close the process-wide HTTP client, if one was created"""
+    if _http_client is not None:
+        await _http_client.close()
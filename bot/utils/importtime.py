@@ -0,0 +1,115 @@
+"""
+Per-module import timing, like `python -X importtime` but readable at runtime
+"""
+import importlib.abc
+import logging
+import sys
+import threading
+import time
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+class _TimedLoader:
+    """Loader proxy that times exec_module and hands the module back its real loader"""
+
+    def __init__(self, timer: "ImportTimer", loader):
+        self._timer = timer
+        self._loader = loader
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        spec = module.__spec__
+        # Later introspection (importlib.resources, pkgutil) should see the original loader
+        spec.loader = self._loader
+        module.__loader__ = self._loader
+        self._timer._run(module.__name__, self._loader.exec_module, module)
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+    """Meta path hook that records self and cumulative import time per module
+
+    Install it as early as possible (before the heavy imports) from the
+    entry point; only modules imported afterwards are measured.
+    """
+
+    def __init__(self):
+        self.timings: Dict[str, Dict[str, float]] = {}
+        self._local = threading.local()
+        self._installed_at = None
+
+    def install(self) -> None:
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+            self._installed_at = time.monotonic()
+
+    def uninstall(self) -> None:
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(self, spec.loader)
+                return spec
+        return None
+
+    def _run(self, name: str, exec_module, module) -> None:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        # Each frame accumulates the time spent importing its children
+        stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            exec_module(module)
+        finally:
+            cumulative = time.perf_counter() - started
+            children = stack.pop()
+            if stack:
+                stack[-1] += cumulative
+            self.timings[name] = {"self": cumulative - children, "cumulative": cumulative}
+
+    def report(self, limit: int = 20, top_level: bool = False) -> List[dict]:
+        """Slowest imports, by cumulative time, in milliseconds
+
+        With `top_level`, sub-modules are folded into their top-level package
+        (e.g. everything under google.* counts as "google").
+        """
+        timings = self.timings
+        if top_level:
+            folded: Dict[str, Dict[str, float]] = {}
+            for name, timing in timings.items():
+                entry = folded.setdefault(name.split(".")[0], {"self": 0.0, "cumulative": 0.0})
+                entry["self"] += timing["self"]
+            for root, entry in folded.items():
+                # Sub-modules imported lazily after the package itself are only in the self sum
+                entry["cumulative"] = max(entry["self"], timings.get(root, {}).get("cumulative", 0.0))
+            timings = folded
+
+        ranked = sorted(timings.items(), key=lambda item: item[1]["cumulative"], reverse=True)
+        return [
+            {"module": name, "self_ms": round(t["self"] * 1000, 1), "cumulative_ms": round(t["cumulative"] * 1000, 1)}
+            for name, t in ranked[:limit]
+        ]
+
+    def total_ms(self) -> float:
+        """Import time of everything measured, counting each module once"""
+        return round(sum(t["self"] for t in self.timings.values()) * 1000, 1)
+
+    def log_report(self, limit: int = 15) -> None:
+        """Log the slowest imports in `-X importtime` column order"""
+        lines = [f"{'self [ms]':>10} | {'cumulative':>10} | module"]
+        for row in self.report(limit):
+            lines.append(f"{row['self_ms']:>10} | {row['cumulative_ms']:>10} | {row['module']}")
+        logger.info(f"Import time: {self.total_ms()} ms across {len(self.timings)} modules\n" + "\n".join(lines))
+
+import_timer = ImportTimer()
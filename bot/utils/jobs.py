@@ -0,0 +1,264 @@
+"""
+Durable SQLite-backed background job queue with a worker pool
+"""
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+from bot.utils.errors import UpstreamUnavailableError
+from bot.utils.metrics import metrics
+from bot.utils.resilience import status_code
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class PermanentJobError(Exception):
+    """Raised by a job handler for a failure that retrying cannot fix"""
+
+class Job:
+    """One queued unit of work; `payload` must be JSON-serialisable
+
+    `checkpoint` holds the bytes an earlier attempt saved with
+    DurableJobQueue.checkpoint, or None.
+    """
+
+    def __init__(self, job_id: int, kind: str, payload: dict, attempts: int, checkpoint: Optional[bytes] = None):
+        self.id = job_id
+        self.kind = kind
+        self.payload = payload
+        self.attempts = attempts
+        self.checkpoint = checkpoint
+
+JobHandler = Callable[[Job], Awaitable[Any]]
+FailureHandler = Callable[[Job, Exception], Awaitable[Any]]
+
+def is_permanent(error: BaseException) -> bool:
+    """Whether a failed job would only fail the same way again
+
+    True for PermanentJobError, upstreams we have stopped calling (open
+    circuit, service not configured) and client errors (4xx other than 429)
+    found on the exception or anywhere in its cause chain.
+    """
+    while error is not None:
+        if isinstance(error, (PermanentJobError, UpstreamUnavailableError)):
+            return True
+        status = status_code(error)
+        if status is not None:
+            return status < 500 and status != 429
+        error = error.__cause__
+    return False
+
+class DurableJobQueue:
+    """Run long jobs outside update handlers and survive restarts
+
+    Jobs are written to SQLite before `enqueue` returns. On start-up, jobs
+    left queued or running by a previous process are queued again, so work
+    interrupted by a restart or deploy resumes (handlers must therefore be
+    safe to re-run from the start, and save anything costly to redo with
+    `checkpoint`). A job that raises is retried with backoff up to
+    Config.JOB_MAX_ATTEMPTS times unless the error is permanent (see
+    is_permanent); after that its failure handler runs and it is marked
+    failed. SQLite is only touched from worker threads.
+    """
+
+    def __init__(self, db_path: str, workers: int):
+        self.db_path = db_path
+        self.workers = workers
+        self._handlers: Dict[str, JobHandler] = {}
+        self._failure_handlers: Dict[str, FailureHandler] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+
+    def register(self, kind: str, handler: JobHandler, on_failure: Optional[FailureHandler] = None) -> None:
+        """Register the coroutine that runs jobs of `kind`"""
+        self._handlers[kind] = handler
+        if on_failure is not None:
+            self._failure_handlers[kind] = on_failure
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def _open_db(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, payload TEXT NOT NULL, "
+            "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL, checkpoint BLOB)"
+        )
+        if "checkpoint" not in {row[1] for row in db.execute("PRAGMA table_info(jobs)")}:
+            db.execute("ALTER TABLE jobs ADD COLUMN checkpoint BLOB")
+        db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+        return db
+
+    async def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run a blocking store operation in a worker thread"""
+        def locked() -> Any:
+            with self._lock:
+                return fn(*args)
+        return await asyncio.to_thread(locked)
+
+    def _recover(self) -> list:
+        """Open the store, drop old finished jobs and requeue unfinished ones"""
+        self._db = self._open_db()
+        now = time.time()
+        self._db.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+            (now - Config.JOB_RETENTION,),
+        )
+        resumed = self._db.execute(
+            "UPDATE jobs SET status = 'queued', updated_at = ? WHERE status = 'running'", (now,)
+        ).rowcount
+        pending = [row[0] for row in self._db.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY id")]
+        if pending:
+            logger.info(f"Job queue resuming {len(pending)} pending jobs ({resumed} interrupted by a restart)")
+        return pending
+
+    async def start(self) -> None:
+        """Open the store, requeue unfinished jobs and start the workers"""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        for job_id in await self._run(self._recover):
+            self._queue.put_nowait(job_id)
+        self._publish()
+
+        self._tasks = [asyncio.ensure_future(self._worker(i)) for i in range(self.workers)]
+
+    def _close(self) -> None:
+        self._db.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+        self._db.close()
+        self._db = None
+
+    async def stop(self) -> None:
+        """Stop the workers; jobs they were running stay queued for the next start"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._db is not None:
+            await self._run(self._close)
+
+    def _insert(self, kind: str, payload: str) -> int:
+        now = time.time()
+        return self._db.execute(
+            "INSERT INTO jobs (kind, payload, status, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)",
+            (kind, payload, now, now),
+        ).lastrowid
+
+    async def enqueue(self, kind: str, payload: dict) -> int:
+        """Persist a job and wake a worker; returns the job id"""
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+        if self._db is None:
+            raise RuntimeError("Job queue is not started")
+        job_id = await self._run(self._insert, kind, json.dumps(payload))
+        self._queue.put_nowait(job_id)
+        metrics.inc("jobs_total", kind=kind, result="enqueued")
+        self._publish()
+        return job_id
+
+    def _save_checkpoint(self, job_id: int, data: bytes) -> None:
+        self._db.execute("UPDATE jobs SET checkpoint = ?, updated_at = ? WHERE id = ?", (data, time.time(), job_id))
+
+    async def checkpoint(self, job: Job, data: bytes) -> None:
+        """Save `data` so later attempts of `job` find it in `job.checkpoint`"""
+        job.checkpoint = data
+        await self._run(self._save_checkpoint, job.id, data)
+
+    def _update_status(self, job_id: int, status: str, error: Optional[str]) -> None:
+        # A finished job's checkpoint is no longer needed
+        self._db.execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ?, "
+            "checkpoint = CASE WHEN ? = 'queued' THEN checkpoint END WHERE id = ?",
+            (status, error, time.time(), status, job_id),
+        )
+
+    async def _set_status(self, job_id: int, status: str, error: Optional[str] = None) -> None:
+        await self._run(self._update_status, job_id, status, error)
+
+    def _claim(self, job_id: int) -> Optional[Job]:
+        """Mark a queued job running and load it (None if it is no longer queued)"""
+        row = self._db.execute(
+            "SELECT kind, payload, attempts, checkpoint FROM jobs WHERE id = ? AND status = 'queued'", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        kind, payload, attempts, checkpoint = row
+        self._db.execute(
+            "UPDATE jobs SET status = 'running', attempts = ?, updated_at = ? WHERE id = ?",
+            (attempts + 1, time.time(), job_id),
+        )
+        return Job(job_id, kind, json.loads(payload), attempts + 1, checkpoint)
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job_id = await self._queue.get()
+            job = await self._run(self._claim, job_id)
+            self._publish()
+            if job is None:
+                continue
+            handler = self._handlers.get(job.kind)
+            if handler is None:
+                await self._set_status(job.id, "failed", f"no handler for {job.kind}")
+                continue
+
+            started = time.monotonic()
+            try:
+                await handler(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self._handle_failure(job, e)
+            else:
+                await self._set_status(job.id, "done")
+                metrics.inc("jobs_total", kind=job.kind, result="done")
+            finally:
+                metrics.observe("job_duration_seconds", time.monotonic() - started, kind=job.kind)
+                self._publish()
+
+    async def _handle_failure(self, job: Job, error: Exception) -> None:
+        permanent = is_permanent(error)
+        if not permanent and job.attempts < Config.JOB_MAX_ATTEMPTS:
+            delay = random.uniform(0, Config.JOB_RETRY_DELAY * (2 ** (job.attempts - 1)))
+            logger.warning(f"Job {job.id} ({job.kind}) attempt {job.attempts} failed, retrying in {delay:.1f}s: {error}")
+            await self._set_status(job.id, "queued", str(error))
+            metrics.inc("jobs_total", kind=job.kind, result="retried")
+            asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, job.id)
+            return
+
+        if permanent:
+            logger.warning(f"Job {job.id} ({job.kind}) failed permanently: {error}")
+        else:
+            logger.error(f"Job {job.id} ({job.kind}) failed after {job.attempts} attempts: {error}")
+        await self._set_status(job.id, "failed", str(error))
+        metrics.inc("jobs_total", kind=job.kind, result="failed")
+        on_failure = self._failure_handlers.get(job.kind)
+        if on_failure is not None:
+            try:
+                await on_failure(job, error)
+            except Exception as e:
+                logger.error(f"Failure handler for job {job.id} raised: {e}")
+
+    def _publish(self) -> None:
+        if self._queue is not None:
+            metrics.set_gauge("jobs_queued", self._queue.qsize())
+
+    def _count(self) -> dict:
+        return dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    async def stats(self) -> dict:
+        if self._db is None:
+            return {"running": False}
+        return {"running": self.running, "workers": self.workers, **await self._run(self._count)}
+
+job_queue = DurableJobQueue(Config.JOB_DB_PATH, Config.JOB_WORKERS)
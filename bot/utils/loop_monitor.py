@@ -0,0 +1,161 @@
+"""
+Event-loop lag sampling and blocking-call detection
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import List, Optional
+from bot.utils.metrics import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Loop lag is usually sub-millisecond; anything in the upper buckets is a stall
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class BlockingCallError(AssertionError):
+    """Raised by LoopLagMonitor used as a context manager when the loop was blocked"""
+
+def _culprit(frame) -> str:
+    """The innermost project frame in a stack, e.g. "bot/services/gemini_service.py:generate_response" """
+    innermost = None
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        label = f"{os.path.relpath(filename, _PROJECT_ROOT)}:{frame.f_code.co_name}"
+        if innermost is None:
+            innermost = f"{os.path.basename(filename)}:{frame.f_code.co_name}"
+        if filename.startswith(_PROJECT_ROOT + os.sep) and filename != os.path.abspath(__file__) and "site-packages" not in filename:
+            return label
+        frame = frame.f_back
+    return innermost or "unknown"
+
+class LoopLagMonitor:
+    """Measure event-loop lag and catch the code that blocks the loop
+
+    A task on the loop sleeps for `interval` seconds and records how late it
+    wakes up. A watchdog thread watches that heartbeat: once it is more than
+    `threshold` seconds overdue, the loop is blocked right now, so the
+    watchdog captures the loop thread's stack and attributes the stall to the
+    innermost frame from this project (the handler or service function
+    responsible). Stalls are logged, counted in `event_loop_blocked_total`
+    and `event_loop_blocked_seconds`, and kept in `stalls`.
+
+    In tests, use it as an async context manager to fail when the code under
+    test blocks:
+
+        async with LoopLagMonitor(threshold=0.05):
+            await gemini_handler(update, context)  # raises BlockingCallError on a stall
+    """
+
+    def __init__(self, interval: float = None, threshold: float = None, history: int = 50):
+        self.interval = interval or Config.LOOP_LAG_INTERVAL
+        self.threshold = threshold or Config.LOOP_BLOCK_THRESHOLD
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = deque(maxlen=history)
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._heartbeat = time.monotonic()
+        self._beat = 0
+        self._captured_beat = -1
+        self._loop_thread_id: Optional[int] = None
+
+    def start(self) -> asyncio.Task:
+        """Start monitoring the running loop (call from the loop's thread)"""
+        if self._task is None:
+            self._loop_thread_id = threading.get_ident()
+            self._heartbeat = time.monotonic()
+            self._stopping.clear()
+            self._task = asyncio.ensure_future(self._run())
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+        return self._task
+
+    async def stop(self) -> None:
+        """Stop the heartbeat task and the watchdog thread"""
+        self._stopping.set()
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        self._watchdog = None
+
+    async def _run(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._heartbeat = now
+            self._beat += 1
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            metrics.observe("event_loop_lag_seconds", lag, buckets=LAG_BUCKETS)
+            metrics.set_gauge("event_loop_lag_last_seconds", lag)
+
+            if self.stalls and self.stalls[-1]["beat"] == self._beat - 1 and self.stalls[-1]["duration"] is None:
+                # The stall the watchdog caught has ended; now we know how long it was
+                stall = self.stalls[-1]
+                stall["duration"] = round(lag, 3)
+                metrics.observe("event_loop_blocked_seconds", lag, buckets=LAG_BUCKETS, culprit=stall["culprit"])
+
+    def _watch(self) -> None:
+        while not self._stopping.wait(self.threshold / 4):
+            overdue = time.monotonic() - self._heartbeat - self.interval
+            beat = self._beat
+            if overdue < self.threshold or self._captured_beat == beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            self._captured_beat = beat
+            self._record_stall(beat, overdue, frame)
+
+    def _record_stall(self, beat: int, overdue: float, frame) -> None:
+        culprit = _culprit(frame)
+        stack = "".join(traceback.format_stack(frame))
+        self.stalls.append({
+            "beat": beat,
+            "at": time.time(),
+            "culprit": culprit,
+            "duration": None,
+            "stack": stack,
+        })
+        metrics.inc("event_loop_blocked_total", culprit=culprit)
+        logger.warning(f"Event loop blocked for over {overdue * 1000:.0f}ms in {culprit}\n{stack}")
+
+    def stats(self) -> dict:
+        return {
+            "last_lag": round(self.last_lag, 4),
+            "max_lag": round(self.max_lag, 4),
+            "threshold": self.threshold,
+            "recent_stalls": [
+                {key: stall[key] for key in ("at", "culprit", "duration")} for stall in self.stalls
+            ],
+        }
+
+    async def __aenter__(self) -> "LoopLagMonitor":
+        self._started_stalls = len(self.stalls)
+        self.start()
+        # Let the first heartbeat land so the watchdog has a baseline
+        await asyncio.sleep(0)
+        return self
+
+    async def __aexit__(self, exc_type, *exc_info) -> None:
+        # One more beat so a stall at the very end is both caught and measured
+        await asyncio.sleep(self.interval + self.threshold)
+        await self.stop()
+        new_stalls: List[dict] = list(self.stalls)[self._started_stalls:]
+        if new_stalls and exc_type is None:
+            details = "\n\n".join(f"{stall['culprit']}:\n{stall['stack']}" for stall in new_stalls)
+            raise BlockingCallError(f"Event loop blocked {len(new_stalls)} time(s):\n\n{details}")
+
+loop_monitor = LoopLagMonitor()
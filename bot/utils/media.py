@@ -0,0 +1,161 @@
+"""
+In-memory media buffers with disk spill-over for large uploads
+"""
+import asyncio
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+from typing import Optional
+from bot.utils.metrics import metrics
+from bot.utils.tracing import span
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def _unlink(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+class _Capture:
+    """Write target for File.download_to_memory that keeps the downloaded bytes object instead of copying it"""
+
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data: bytes) -> int:
+        # PTB writes the whole payload in one call; join only if it ever doesn't
+        self.data = data if not self.data else self.data + data
+        return len(data)
+
+def _spill_path() -> str:
+    fd, path = tempfile.mkstemp(prefix="media-", dir=Config.MEDIA_SPILL_DIR)
+    os.close(fd)
+    return path
+
+class MediaBuffer:
+    """A media payload shared by every consumer of an upload
+
+    Payloads up to `Config.MEDIA_SPILL_THRESHOLD` bytes stay in memory and are
+    handed out as the same `bytes` object (no copies). Larger payloads live in
+    a file in `Config.MEDIA_SPILL_DIR` (point it at a tmpfs such as /dev/shm
+    to keep spills off the disk). `view()` gives a zero-copy memoryview of
+    either kind (memory-mapping spill files); use it wherever a bytes-like
+    object will do, and `read()` only for APIs that insist on `bytes`.
+    """
+
+    def __init__(self, data: bytes, mime_type: str = "application/octet-stream", spill_threshold: Optional[int] = None):
+        self.mime_type = mime_type
+        self.size = len(data)
+        self._data: Optional[bytes] = data
+        self._path: Optional[str] = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._sha256: Optional[str] = None
+
+        threshold = Config.MEDIA_SPILL_THRESHOLD if spill_threshold is None else spill_threshold
+        self._spill_pending = self.size > threshold
+
+    @classmethod
+    async def from_telegram_file(cls, file_obj, mime_type: str) -> "MediaBuffer":
+        """Download a Telegram file, spilling it to disk when it is large
+
+        PTB hands over the downloaded body as one bytes object; it is kept
+        without copying and, if large, written out from a worker thread.
+        """
+        with span("media.download", mime_type=mime_type) as current:
+            capture = _Capture()
+            await file_obj.download_to_memory(capture)
+            buffer = cls(capture.data, mime_type)
+            await buffer._spill()
+            metrics.inc("telegram_bytes_total", buffer.size, direction="download")
+            if current is not None:
+                current.attrs["bytes"] = buffer.size
+        return buffer
+
+    @classmethod
+    async def from_path(cls, path: str, mime_type: str) -> "MediaBuffer":
+        """Load a local file into a buffer"""
+        def _read() -> bytes:
+            with open(path, "rb") as f:
+                return f.read()
+
+        buffer = cls(await asyncio.to_thread(_read), mime_type)
+        await buffer._spill()
+        return buffer
+
+    @property
+    def in_memory(self) -> bool:
+        return self._data is not None
+
+    async def _spill(self) -> None:
+        """Move the payload to the spill directory if it exceeds the threshold"""
+        if not self._spill_pending or self._data is None:
+            return
+
+        def _write(data: bytes) -> str:
+            path = _spill_path()
+            with open(path, "wb") as f:
+                f.write(data)
+            return path
+
+        self._path = await asyncio.to_thread(_write, self._data)
+        self._data = None
+        self._spill_pending = False
+        logger.debug(f"Spilled {self.size} byte media payload to {self._path}")
+
+    async def view(self) -> memoryview:
+        """Zero-copy view of the payload; spill files are memory-mapped once and shared"""
+        if self._data is not None:
+            return memoryview(self._data)
+        if self._mmap is None:
+            def _map(path: str) -> mmap.mmap:
+                with open(path, "rb") as f:
+                    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            self._mmap = await asyncio.to_thread(_map, self._path)
+        return memoryview(self._mmap)
+
+    async def read(self) -> bytes:
+        """Return the payload as `bytes` (the shared in-memory object when not spilled)
+
+        For a spilled payload this copies the file into memory; prefer
+        `view()` unless the consumer requires `bytes`.
+        """
+        if self._data is not None:
+            return self._data
+
+        def _read(path: str) -> bytes:
+            with open(path, "rb") as f:
+                return f.read()
+
+        return await asyncio.to_thread(_read, self._path)
+
+    async def sha256(self) -> str:
+        """Content hash of the payload, computed once"""
+        if self._sha256 is None:
+            data = await self.view()
+            self._sha256 = await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+        return self._sha256
+
+    async def close(self) -> None:
+        """Release memory and delete any spill file"""
+        self._data = None
+        if self._mmap is not None:
+            mapped, self._mmap = self._mmap, None
+            try:
+                mapped.close()
+            except BufferError:
+                # A consumer still holds a view; the mapping goes when it does
+                pass
+        if self._path is not None:
+            path, self._path = self._path, None
+            await asyncio.to_thread(_unlink, path)
+
+    async def __aenter__(self) -> "MediaBuffer":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
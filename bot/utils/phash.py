@@ -0,0 +1,128 @@
+"""
+Perceptual image hashing and a Hamming-distance index for near-duplicate lookups
+"""
+import io
+import logging
+from collections import OrderedDict
+from itertools import combinations
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; near-duplicate matching is disabled without it
+    Image = None
+
+HASH_BITS = 64
+
+def phash_available() -> bool:
+    """Whether perceptual hashing can be used in this environment"""
+    return Image is not None
+
+def dhash(data: Union[bytes, memoryview], hash_size: int = 8) -> Optional[int]:
+    """Compute a 64-bit difference hash of an image
+
+    The image is reduced to a (hash_size + 1) x hash_size greyscale thumbnail
+    and each bit records whether a pixel is brighter than its right-hand
+    neighbour, which survives recompression, resizing and small crops.
+    CPU-bound; call it from a worker thread.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.draft("L", (hash_size * 8, hash_size * 8))  # Fast JPEG downscale on decode
+            pixels = list(
+                image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS).getdata()
+            )
+    except Exception as e:
+        logger.debug(f"Could not compute perceptual hash: {e}")
+        return None
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+class HammingIndex:
+    """Bounded multi-index hash table for 64-bit hashes
+
+    Each hash is split into `bands` chunks with one lookup table per chunk.
+    By the pigeonhole principle, any hash within distance d of the query
+    matches it to within d // bands bits in at least one chunk, so a query only
+    probes those chunk neighbourhoods instead of scanning every entry.
+    """
+
+    def __init__(self, maxsize: int, bands: int = 4):
+        self.maxsize = maxsize
+        self.bands = bands
+        self.band_bits = HASH_BITS // bands
+        self._mask = (1 << self.band_bits) - 1
+        self._entries: "OrderedDict[int, str]" = OrderedDict()
+        self._tables: List[Dict[int, Set[int]]] = [{} for _ in range(bands)]
+
+    def _chunks(self, value: int) -> List[int]:
+        return [(value >> (i * self.band_bits)) & self._mask for i in range(self.bands)]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, value: int, payload: str) -> None:
+        """Insert or refresh a hash, evicting the least recently used entries beyond `maxsize`"""
+        if value in self._entries:
+            self._entries[value] = payload
+            self._entries.move_to_end(value)
+            return
+
+        self._entries[value] = payload
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            table.setdefault(chunk, set()).add(value)
+
+        while len(self._entries) > self.maxsize:
+            old_value, _ = self._entries.popitem(last=False)
+            self._remove_from_tables(old_value)
+
+    def _remove_from_tables(self, value: int) -> None:
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            bucket = table.get(chunk)
+            if bucket is not None:
+                bucket.discard(value)
+                if not bucket:
+                    del table[chunk]
+
+    def _probe(self, chunk: int, radius: int):
+        """Yield every chunk value within `radius` bits of `chunk`"""
+        yield chunk
+        for r in range(1, radius + 1):
+            for bits in combinations(range(self.band_bits), r):
+                flipped = chunk
+                for bit in bits:
+                    flipped ^= 1 << bit
+                yield flipped
+
+    def find(self, value: int, max_distance: int) -> Optional[Tuple[str, int]]:
+        """Return (payload, distance) of the closest stored hash within `max_distance`"""
+        radius = max_distance // self.bands
+        best: Optional[Tuple[int, int]] = None
+        seen: Set[int] = set()
+
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            for probe in self._probe(chunk, radius):
+                for candidate in table.get(probe, ()):
+                    if candidate in seen:
+                        continue
+                    seen.add(candidate)
+                    distance = hamming_distance(value, candidate)
+                    if distance <= max_distance and (best is None or distance < best[1]):
+                        best = (candidate, distance)
+
+        if best is None:
+            return None
+        self._entries.move_to_end(best[0])
+        return self._entries[best[0]], best[1]
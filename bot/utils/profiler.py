@@ -0,0 +1,116 @@
+"""
+On-demand sampling CPU profiler and tracemalloc snapshots for a live process
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import List, Optional
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Leaf frames of threads that are idle rather than working (waiting on I/O or a lock)
+_IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+class ProfilerBusyError(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+_busy = threading.Lock()
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES
+
+def sample_stacks(seconds: float, interval: float, include_idle: bool = False) -> Counter:
+    """Sample every thread's stack (except the sampler's own) for `seconds`
+
+    Runs in the calling thread, which must not be the event loop's: sampling
+    from a separate thread is what lets a blocked loop show up in the profile.
+    Returns collapsed stacks ("thread;outer;...;inner") mapped to sample counts.
+    """
+    me = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me or (not include_idle and _is_idle(frame)):
+                continue
+            frames: List[str] = []
+            while frame is not None:
+                frames.append(_frame_label(frame))
+                frame = frame.f_back
+            thread_name = names.get(thread_id) or str(thread_id)
+            stacks[";".join([thread_name] + frames[::-1])] += 1
+        time.sleep(interval)
+    return stacks
+
+def format_collapsed(stacks: Counter) -> str:
+    """Collapsed-stack text, the input format of flamegraph.pl and speedscope"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+async def profile_cpu(seconds: float, interval: Optional[float] = None, include_idle: bool = False) -> str:
+    """Sample the whole process for `seconds` and return collapsed stacks"""
+    seconds = min(seconds, Config.PROFILE_MAX_SECONDS)
+    interval = interval or Config.PROFILE_INTERVAL
+    if not _busy.acquire(blocking=False):
+        raise ProfilerBusyError("A profile is already running")
+    try:
+        logger.info(f"Sampling stacks for {seconds}s every {interval * 1000:.0f}ms")
+        stacks = await asyncio.to_thread(sample_stacks, seconds, interval, include_idle)
+    finally:
+        _busy.release()
+    return format_collapsed(stacks)
+
+async def profile_memory(seconds: float, top: int = 25) -> dict:
+    """Trace allocations for `seconds` and report the largest allocation sites and growth
+
+    Only allocations made while tracing is on are visible, so unless
+    tracemalloc is already running this starts it, waits and stops it again.
+    """
+    seconds = min(seconds, Config.PROFILE_MAX_SECONDS)
+    if not _busy.acquire(blocking=False):
+        raise ProfilerBusyError("A profile is already running")
+    started_here = not tracemalloc.is_tracing()
+    try:
+        if started_here:
+            tracemalloc.start(Config.TRACEMALLOC_FRAMES)
+        before = tracemalloc.take_snapshot()
+        await asyncio.sleep(seconds)
+        after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started_here:
+            tracemalloc.stop()
+        _busy.release()
+
+    def _trace(stat) -> List[str]:
+        return [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback]
+
+    return {
+        "seconds": seconds,
+        "traced_current_bytes": current,
+        "traced_peak_bytes": peak,
+        "top": [
+            {"size": stat.size, "count": stat.count, "traceback": _trace(stat)}
+            for stat in after.statistics("traceback")[:top]
+        ],
+        "growth": [
+            {"size_diff": stat.size_diff, "count_diff": stat.count_diff, "traceback": _trace(stat)}
+            for stat in after.compare_to(before, "traceback")[:top]
+        ],
+    }
@@ -0,0 +1,333 @@
+"""
+Outbound Telegram rate limiting with global, per-chat and per-group token buckets
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Any, Callable, Coroutine, Dict, Hashable, List, Optional, Tuple, Union
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from bot.utils.metrics import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Edits of one message through the same method can be merged: only the latest content matters
+EDIT_ENDPOINTS = {"editMessageText", "editMessageCaption", "editMessageMedia", "editMessageReplyMarkup"}
+
+# Prune idle per-chat state once this many chats are tracked
+MAX_TRACKED_CHATS = 1024
+
+# Send waits range from zero (tokens available) to tens of seconds (group limit or flood wait)
+WAIT_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `capacity` (the allowed burst)"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+class _PendingEdit:
+    """An edit waiting for its turn; a newer edit of the same message supersedes it"""
+
+    def __init__(self, result: asyncio.Future, turn: asyncio.Future):
+        self.result = result
+        self.turn = turn
+        self.superseded_by: Optional[asyncio.Future] = None
+
+    def supersede(self, result: asyncio.Future) -> None:
+        self.superseded_by = result
+        if not self.turn.done():
+            # Wake it from the chat's queue so it can leave
+            self.turn.set_result(None)
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+def _retrieve_exception(future: asyncio.Future) -> None:
+    # Nobody may be waiting on an edit's result; don't log "exception was never retrieved"
+    if not future.cancelled():
+        future.exception()
+
+class OutboundRateLimiter(BaseRateLimiter):
+    """Keep outbound Telegram requests just under the flood limits
+
+    Every request addressed to a chat takes a token from the global bucket
+    and from that chat's bucket; groups and channels (negative or @username
+    chat ids) also take one from a per-group bucket. Rates and bursts
+    default a little below Telegram's limits (about 30 messages a second
+    overall, one a second per chat, 20 a minute per group), so requests wait
+    their turn here instead of being rejected with 429.
+
+    A 429 that gets through anyway pauses the chat it was addressed to for
+    its `retry_after` before the request is retried (up to
+    Config.TG_MAX_RETRIES times, or `rate_limit_args` if given).
+
+    Two kinds of request are cheaper to skip than to send:
+
+    * `send_chat_action` is dropped (reported as sent) when a message to
+      the same chat is already waiting, the same action was sent less than
+      Config.TG_CHAT_ACTION_TTL seconds ago, the chat is paused, or it could
+      not go out within Config.TG_CHAT_ACTION_MAX_DELAY seconds.
+    * An edit still waiting for its turn is merged into a newer edit of the
+      same message: only the newer one is sent, and both callers get its
+      result.
+
+    Requests to one chat go out one at a time, in the order they were
+    made, so messages arrive in order and none waits behind later ones.
+    Requests without a chat (get_file, set_webhook, inline message edits)
+    are not limited.
+    """
+
+    def __init__(self):
+        self._global = self._bucket(Config.TG_GLOBAL_RATE, Config.TG_GLOBAL_BURST)
+        self._chats: Dict[Hashable, TokenBucket] = {}
+        self._groups: Dict[Hashable, TokenBucket] = {}
+        self._paused_until: Dict[Hashable, float] = {}
+        self._turns: Dict[Hashable, deque] = {}
+        self._last_action: Dict[Hashable, Tuple[str, float]] = {}
+        self._edits: Dict[Tuple[Hashable, Any, str], _PendingEdit] = {}
+
+    @staticmethod
+    def _bucket(rate: float, burst: float) -> Optional[TokenBucket]:
+        return TokenBucket(rate, max(1.0, burst)) if rate > 0 else None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @staticmethod
+    def _chat_key(chat_id: Union[int, str]) -> Hashable:
+        try:
+            return int(chat_id)
+        except (TypeError, ValueError):
+            return str(chat_id)
+
+    @staticmethod
+    def _is_group(chat: Hashable) -> bool:
+        return isinstance(chat, str) or chat < 0
+
+    def _buckets_for(self, chat: Hashable) -> List[TokenBucket]:
+        if len(self._chats) > MAX_TRACKED_CHATS:
+            self._prune()
+        buckets = [self._global] if self._global is not None else []
+        if chat not in self._chats:
+            self._chats[chat] = self._bucket(Config.TG_CHAT_RATE, Config.TG_CHAT_BURST)
+        if self._chats[chat] is not None:
+            buckets.append(self._chats[chat])
+        if self._is_group(chat):
+            if chat not in self._groups:
+                self._groups[chat] = self._bucket(Config.TG_GROUP_PER_MINUTE / 60, Config.TG_GROUP_BURST)
+            if self._groups[chat] is not None:
+                buckets.append(self._groups[chat])
+        return buckets
+
+    def _prune(self) -> None:
+        """Forget chats whose buckets are full again and that have nothing waiting"""
+        now = time.monotonic()
+        for chat in list(self._chats):
+            bucket, group = self._chats[chat], self._groups.get(chat)
+            if chat in self._turns or (bucket is not None and not bucket.full(now)) or (group is not None and not group.full(now)):
+                continue
+            del self._chats[chat]
+            self._groups.pop(chat, None)
+            self._last_action.pop(chat, None)
+        for chat, until in list(self._paused_until.items()):
+            if until <= now:
+                del self._paused_until[chat]
+
+    def _join(self, chat: Hashable) -> asyncio.Future:
+        """Queue behind earlier requests to `chat`; the future is set when it is this one's turn"""
+        turn = asyncio.get_running_loop().create_future()
+        queue = self._turns.setdefault(chat, deque())
+        queue.append(turn)
+        if len(queue) == 1:
+            turn.set_result(None)
+        return turn
+
+    def _leave(self, chat: Hashable, turn: asyncio.Future) -> None:
+        queue = self._turns[chat]
+        queue.remove(turn)
+        if not queue:
+            del self._turns[chat]
+        elif not queue[0].done():
+            queue[0].set_result(None)
+
+    def _pause_left(self, chat: Hashable, now: float) -> float:
+        return max(0.0, self._paused_until.get(chat, 0.0) - now)
+
+    async def _wait_turn(
+        self, chat: Hashable, buckets: List[TokenBucket], edit: Optional[_PendingEdit] = None, max_delay: Optional[float] = None
+    ) -> bool:
+        """Wait until every bucket has a token and take them
+
+        Returns False without taking tokens if the wait would exceed
+        `max_delay` or `edit` was superseded while waiting.
+        """
+        started = time.monotonic()
+        while True:
+            if edit is not None and edit.superseded_by is not None:
+                return False
+            now = time.monotonic()
+            delay = max([self._pause_left(chat, now)] + [bucket.delay(now) for bucket in buckets])
+            if delay <= 0:
+                for bucket in buckets:
+                    bucket.take(now)
+                metrics.observe("telegram_send_wait_seconds", now - started, buckets=WAIT_BUCKETS)
+                return True
+            if max_delay is not None and now + delay - started > max_delay:
+                return False
+            await asyncio.sleep(delay)
+
+    def _pause(self, chat: Hashable, error: RetryAfter, endpoint: str) -> float:
+        seconds = _retry_after_seconds(error) + 0.1
+        self._paused_until[chat] = max(self._paused_until.get(chat, 0.0), time.monotonic() + seconds)
+        metrics.inc("telegram_flood_waits_total", endpoint=endpoint)
+        logger.warning(f"Telegram flood limit hit on {endpoint} for chat {chat}; pausing it for {seconds:.1f}s")
+        return seconds
+
+    def _drop(self, reason: str) -> bool:
+        metrics.inc("telegram_requests_dropped_total", reason=reason)
+        return True
+
+    async def _send_chat_action(self, chat: Hashable, action: str, callback, args, kwargs) -> Any:
+        now = time.monotonic()
+        if chat in self._turns:
+            # A message is on its way, and sending it clears the action anyway
+            return self._drop("message_pending")
+        last = self._last_action.get(chat)
+        if last is not None and last[0] == action and now - last[1] < Config.TG_CHAT_ACTION_TTL:
+            return self._drop("still_showing")
+        if self._pause_left(chat, now) > 0:
+            return self._drop("paused")
+        # Chat actions only count against the global limit
+        buckets = [self._global] if self._global is not None else []
+        if not await self._wait_turn(chat, buckets, max_delay=Config.TG_CHAT_ACTION_MAX_DELAY):
+            return self._drop("throttled")
+        try:
+            result = await callback(*args, **kwargs)
+        except RetryAfter as e:
+            self._pause(chat, e, "sendChatAction")
+            return self._drop("flood_wait")
+        self._last_action[chat] = (action, time.monotonic())
+        metrics.inc("telegram_requests_total", endpoint="sendChatAction")
+        return result
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Any:
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+        chat = self._chat_key(chat_id)
+        if endpoint == "sendChatAction":
+            return await self._send_chat_action(chat, str(data.get("action")), callback, args, kwargs)
+
+        max_retries = Config.TG_MAX_RETRIES if rate_limit_args is None else rate_limit_args
+        edit_key = (chat, data.get("message_id"), endpoint) if endpoint in EDIT_ENDPOINTS else None
+        result: Optional[asyncio.Future] = None
+        if edit_key is not None:
+            result = asyncio.get_running_loop().create_future()
+            result.add_done_callback(_retrieve_exception)
+
+        # The turn is held through retries so a flood wait doesn't reorder the chat's messages
+        turn = self._join(chat)
+        edit: Optional[_PendingEdit] = None
+        try:
+            for attempt in range(max_retries + 1):
+                if edit_key is not None:
+                    edit = _PendingEdit(result, turn)
+                    previous = self._edits.get(edit_key)
+                    if previous is not None:
+                        if attempt > 0:
+                            # A newer edit of this message is already waiting; let it carry this one
+                            edit.superseded_by = previous.result
+                            break
+                        previous.supersede(result)
+                    self._edits[edit_key] = edit
+
+                try:
+                    await turn
+                    sent = await self._wait_turn(chat, self._buckets_for(chat), edit)
+                finally:
+                    if edit is not None and self._edits.get(edit_key) is edit:
+                        del self._edits[edit_key]
+                if not sent:
+                    break
+
+                try:
+                    outcome = await callback(*args, **kwargs)
+                except RetryAfter as e:
+                    seconds = self._pause(chat, e, endpoint)
+                    if attempt == max_retries:
+                        raise
+                    logger.info(f"Retrying {endpoint} for chat {chat} in {seconds:.1f}s")
+                    continue
+                if edit_key is None:
+                    # A new message ends any chat action shown in the chat
+                    self._last_action.pop(chat, None)
+                metrics.inc("telegram_requests_total", endpoint=endpoint)
+                break
+        except BaseException as e:
+            if result is not None and not result.done():
+                if isinstance(e, Exception):
+                    result.set_exception(e)
+                else:
+                    result.cancel()
+            raise
+        finally:
+            self._leave(chat, turn)
+
+        if edit is not None and edit.superseded_by is not None:
+            # Out of the queue now, so the newer edit can take its turn
+            metrics.inc("telegram_requests_dropped_total", reason="edit_merged")
+            outcome = await asyncio.shield(edit.superseded_by)
+        if result is not None and not result.done():
+            result.set_result(outcome)
+        return outcome
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        if self._global is not None:
+            self._global.delay(now)  # Refill before reporting
+        return {
+            "global_tokens": round(self._global.tokens, 2) if self._global is not None else None,
+            "chats_tracked": len(self._chats),
+            "requests_waiting": sum(len(queue) for queue in self._turns.values()),
+            "paused_chats": sum(1 for until in self._paused_until.values() if until > now),
+        }
+
+rate_limiter = OutboundRateLimiter()
@@ -0,0 +1,321 @@
+"""
+Circuit breakers, retry budgets, hedging and adaptive timeouts for upstream services
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+from bot.utils.bulkhead import get_bulkhead
+from bot.utils.errors import UpstreamUnavailableError
+from bot.utils.http_client import HttpError
+from bot.utils.metrics import metrics
+from bot.utils.tracing import span
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(UpstreamUnavailableError):
+    """Raised without calling the upstream while its circuit is open"""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} is temporarily unavailable")
+        self.name = name
+        self.retry_in = retry_in
+
+def status_code(error: BaseException) -> Optional[int]:
+    """The HTTP status an error carries, whichever client raised it
+
+    Covers our HttpError (`status`), google-genai APIError (`code`),
+    google.api_core GoogleAPICallError (`code`, an HTTPStatus) and aiohttp's
+    ClientResponseError (`status`). Non-numeric codes (gRPC names, errno) are ignored.
+    """
+    if isinstance(error, HttpError):
+        return error.status
+    for attr in ("code", "status_code", "status"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int) and not isinstance(value, bool) and 100 <= value < 600:
+            return int(value)
+    return None
+
+def is_failure(error: BaseException) -> bool:
+    """Whether an error says something about the upstream's health
+
+    Client errors (4xx other than 429, from any SDK) and our own load
+    shedding are the caller's problem: they neither trip the breaker nor
+    get retried. A bad upload from one user must not open the circuit for
+    everyone.
+    """
+    if isinstance(error, UpstreamUnavailableError):
+        return False
+    status = status_code(error)
+    if status is not None:
+        return status >= 500 or status == 429
+    return True
+
+class CircuitBreaker:
+    """Closed/open/half-open circuit breaker driven by consecutive failures"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, recovery_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            logger.warning(f"Circuit '{self.name}' {self.state} -> {state}")
+            self.state = state
+            metrics.inc("circuit_transitions_total", upstream=self.name, state=state)
+        metrics.set_gauge("circuit_open", 1 if state == self.OPEN else 0, upstream=self.name)
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError unless a call may go through"""
+        if self.state == self.OPEN:
+            elapsed = time.monotonic() - self._opened_at
+            if elapsed < self.recovery_timeout:
+                raise CircuitOpenError(self.name, self.recovery_timeout - elapsed)
+            self._set_state(self.HALF_OPEN)
+
+        if self.state == self.HALF_OPEN:
+            # Let exactly one probe through; everyone else keeps failing fast
+            if self._probe_in_flight:
+                raise CircuitOpenError(self.name, self.recovery_timeout)
+            self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        self._probe_in_flight = False
+        self._failures = 0
+        self._set_state(self.CLOSED)
+
+    def record_failure(self) -> None:
+        self._probe_in_flight = False
+        self._failures += 1
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+    def release(self) -> None:
+        """Forget a probe whose outcome said nothing about upstream health"""
+        self._probe_in_flight = False
+
+class RetryBudget:
+    """Token bucket that limits retries to a fraction of recent requests"""
+
+    def __init__(self, ratio: float, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+
+    def record_request(self) -> None:
+        self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+class LatencyWindow:
+    """Rolling window of recent call latencies for one endpoint"""
+
+    def __init__(self, size: int):
+        self._samples = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """The q-quantile (0..1) of the window, or None until it holds enough samples"""
+        if len(self._samples) < Config.LATENCY_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+class ResiliencePolicy:
+    """Bulkhead, timeout, retry, hedging and circuit-breaker policy for one upstream
+
+    Each attempt takes a slot in the upstream's bulkhead, so backoff sleeps
+    between retries don't hold capacity. Bulkhead queueing is not counted
+    against the call timeout.
+
+    Timeouts adapt to the endpoint's recent latency: a multiple of its p99,
+    never above the configured timeout, which also applies until enough
+    samples have been seen. Hedged calls send a duplicate when the first copy
+    outlives the endpoint's p95, and take whichever answers first.
+    """
+
+    def __init__(self, name: str, timeout: float, max_retries: int):
+        self.name = name
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.breaker = CircuitBreaker(name, Config.CIRCUIT_FAILURE_THRESHOLD, Config.CIRCUIT_RECOVERY_TIMEOUT)
+        self.budget = RetryBudget(Config.RETRY_BUDGET_RATIO)
+        self.bulkhead = get_bulkhead(name)
+        self.latency: Dict[str, LatencyWindow] = {}
+
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        cap = min(Config.RETRY_MAX_DELAY, Config.RETRY_BASE_DELAY * (2 ** attempt))
+        return random.uniform(0, cap)
+
+    def _window(self, endpoint: str) -> LatencyWindow:
+        window = self.latency.get(endpoint)
+        if window is None:
+            window = self.latency[endpoint] = LatencyWindow(Config.LATENCY_WINDOW_SIZE)
+        return window
+
+    def adaptive_timeout(self, endpoint: str) -> float:
+        """Timeout for one attempt at an endpoint, derived from its recent latency"""
+        p99 = self._window(endpoint).percentile(Config.ADAPTIVE_TIMEOUT_PERCENTILE)
+        if p99 is None:
+            return self.timeout
+        return min(self.timeout, max(Config.ADAPTIVE_TIMEOUT_MIN, p99 * Config.ADAPTIVE_TIMEOUT_MULTIPLIER))
+
+    def hedge_delay(self, endpoint: str) -> Optional[float]:
+        """How long to wait before hedging a call, or None while latency is unknown"""
+        return self._window(endpoint).percentile(Config.HEDGE_PERCENTILE)
+
+    async def _run_once(self, fn: Callable[[], Awaitable[Any]], endpoint: str, timeout: float) -> Any:
+        """One copy of one attempt: a bulkhead slot, the timeout and latency bookkeeping"""
+        with span(f"{self.name}.{endpoint}", timeout=round(timeout, 2)):
+            async with self.bulkhead:
+                started = time.monotonic()
+                try:
+                    result = await asyncio.wait_for(fn(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    # Count the timeout as a sample so a slowed-down upstream raises its own timeout
+                    self._window(endpoint).add(timeout)
+                    raise
+                elapsed = time.monotonic() - started
+        self._window(endpoint).add(elapsed)
+        metrics.observe("upstream_latency_seconds", elapsed, upstream=self.name, endpoint=endpoint)
+        return result
+
+    async def _attempt(self, fn: Callable[[], Awaitable[Any]], endpoint: str, timeout: float, hedge: bool) -> Any:
+        """Run one attempt, sending a hedge copy if the first is slower than usual"""
+        primary = asyncio.ensure_future(self._run_once(fn, endpoint, timeout))
+        tasks = {primary}
+        try:
+            delay = self.hedge_delay(endpoint) if hedge else None
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                # Hedges are extra load: only while healthy, with a free slot and retry budget left
+                if (not done and self.breaker.state == CircuitBreaker.CLOSED
+                        and self.bulkhead.has_capacity() and self.budget.try_spend()):
+                    metrics.inc("upstream_hedges_total", upstream=self.name, endpoint=endpoint)
+                    tasks.add(asyncio.ensure_future(self._run_once(fn, endpoint, timeout)))
+
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                winner = None
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                    else:
+                        error = task.exception()
+                if winner is not None:
+                    if winner is not primary:
+                        metrics.inc("upstream_hedge_wins_total", upstream=self.name, endpoint=endpoint)
+                    return winner.result()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def call(self, fn: Callable[[], Awaitable[Any]], timeout: float | None = None,
+                   endpoint: str | None = None, hedge: bool = False) -> Any:
+        """Run `fn` under the breaker, with an adaptive timeout and budgeted retries
+
+        Pass `hedge=True` only for idempotent calls; `endpoint` names the
+        latency window (defaults to the upstream name).
+        """
+        endpoint = endpoint or self.name
+        self.budget.record_request()
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                result = await self._attempt(fn, endpoint, timeout or self.adaptive_timeout(endpoint), hedge)
+            except Exception as e:
+                if not is_failure(e):
+                    self.breaker.release()
+                    raise
+                self.breaker.record_failure()
+                metrics.inc("upstream_errors_total", upstream=self.name, error=type(e).__name__)
+
+                if attempt >= self.max_retries or self.breaker.state == CircuitBreaker.OPEN or not self.budget.try_spend():
+                    raise
+                delay = self._backoff(attempt)
+                attempt += 1
+                metrics.inc("upstream_retries_total", upstream=self.name)
+                logger.info(f"Retrying {self.name} in {delay:.2f}s after {type(e).__name__}: {e}")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelled or abandoned part-way; says nothing about the upstream
+                self.breaker.release()
+                raise
+
+            self.breaker.record_success()
+            return result
+
+    @asynccontextmanager
+    async def guard(self):
+        """Breaker bookkeeping for work that cannot be retried (e.g. streams)"""
+        self.breaker.before_call()
+        try:
+            with span(f"{self.name}.stream"):
+                async with self.bulkhead:
+                    yield
+        except Exception as e:
+            if is_failure(e):
+                self.breaker.record_failure()
+                metrics.inc("upstream_errors_total", upstream=self.name, error=type(e).__name__)
+            else:
+                self.breaker.release()
+            raise
+        except BaseException:
+            # Cancelled or abandoned part-way; says nothing about the upstream
+            self.breaker.release()
+            raise
+        else:
+            self.breaker.record_success()
+
+_policies: Dict[str, ResiliencePolicy] = {}
+
+def get_policy(name: str) -> ResiliencePolicy:
+    """Return the resilience policy for an upstream, creating it from Config.RESILIENCE on first use"""
+    policy = _policies.get(name)
+    if policy is None:
+        policy = _policies[name] = ResiliencePolicy(name, *Config.RESILIENCE[name])
+    return policy
+
+def circuit_states() -> dict:
+    """Breaker state for every upstream seen so far"""
+    return {name: policy.breaker.state for name, policy in _policies.items()}
+
+def latency_stats() -> dict:
+    """Current hedge delay and adaptive timeout for every endpoint seen so far"""
+    return {
+        f"{name}.{endpoint}": {
+            "samples": len(window),
+            "hedge_after": policy.hedge_delay(endpoint),
+            "timeout": policy.adaptive_timeout(endpoint),
+        }
+        for name, policy in _policies.items()
+        for endpoint, window in policy.latency.items()
+    }
@@ -0,0 +1,160 @@
+"""
+Cost-class scheduling of update processing with weighted-fair queues and aging
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Tuple
+from telegram import Update
+from bot.utils.metrics import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Commands by expected cost; other commands (/start, /help, /removebg) are static
+# replies and plain text goes to the LLM fallback
+SEARCH_COMMANDS = {"youtube", "movie"}
+LLM_COMMANDS = {"ai"}
+
+# Scheduler wait times span from microseconds (free slot) to minutes (media backlog)
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def classify_update(update: object) -> str:
+    """Expected cost class of an update: static, search, llm or media"""
+    message = update.effective_message if isinstance(update, Update) else None
+    if message is None:
+        return "static"
+    if message.photo or message.video:
+        return "media"
+    text = message.text or ""
+    if text.startswith("/"):
+        command = text[1:].split(maxsplit=1)[0].split("@", 1)[0].lower() if len(text) > 1 else ""
+        if command in SEARCH_COMMANDS:
+            return "search"
+        if command in LLM_COMMANDS:
+            return "llm"
+        return "static"
+    return "llm" if text else "static"
+
+class _ClassQueue:
+    """Waiters and accounting for one cost class"""
+
+    def __init__(self, name: str, weight: float, limit: int, reserved: int):
+        self.name = name
+        self.weight = weight
+        self.limit = limit
+        self.reserved = reserved
+        self.running = 0
+        self.vtime = 0.0
+        self.waiters: Deque[Tuple[float, asyncio.Future]] = deque()
+
+class PriorityScheduler:
+    """Hand out `slots` running slots across cost classes
+
+    Each class has a weight, a cap on the slots it may hold, and optionally
+    slots reserved for it alone. When a slot frees up it goes to the waiting
+    class with the lowest virtual time (weighted-fair queueing: a class's
+    virtual time advances by 1/weight per grant, so a weight-8 class gets
+    eight grants for every one of a weight-1 class). A waiter older than
+    `aging` seconds is served first regardless of weight, so heavy classes
+    are never starved. Reserved slots keep cheap classes responsive even
+    when heavy jobs fill everything else.
+    """
+
+    def __init__(self, slots: int, classes: Dict[str, Tuple[float, float, int]], aging: float):
+        self.slots = slots
+        self.aging = aging
+        self.running = 0
+        self._vclock = 0.0
+        self._classes: Dict[str, _ClassQueue] = {}
+        unreserved = slots
+        for name, (weight, share, reserved) in classes.items():
+            # Always leave at least one slot that any class can use
+            reserved = max(0, min(reserved, unreserved - 1))
+            unreserved -= reserved
+            self._classes[name] = _ClassQueue(name, weight, max(1, int(slots * share)), reserved)
+
+    def _eligible(self, queue: _ClassQueue) -> bool:
+        if self.running >= self.slots or queue.running >= queue.limit:
+            return False
+        held_for_others = sum(
+            max(0, other.reserved - other.running) for other in self._classes.values() if other is not queue
+        )
+        return self.slots - self.running - 1 >= held_for_others
+
+    def _grant(self, queue: _ClassQueue) -> None:
+        self.running += 1
+        queue.running += 1
+        # Start tag never lags the clock, so an idle class can't bank credit
+        start = max(queue.vtime, self._vclock)
+        self._vclock = start
+        queue.vtime = start + 1.0 / queue.weight
+
+    def _dispatch(self) -> None:
+        """Grant free slots to waiting classes: aged waiters first, then by virtual time"""
+        while True:
+            candidates = [q for q in self._classes.values() if q.waiters and self._eligible(q)]
+            if not candidates:
+                return
+            now = time.monotonic()
+            aged = [q for q in candidates if now - q.waiters[0][0] >= self.aging]
+            if aged:
+                queue = min(aged, key=lambda q: q.waiters[0][0])
+            else:
+                queue = min(candidates, key=lambda q: (max(q.vtime, self._vclock), -q.weight))
+            _, future = queue.waiters.popleft()
+            if future.done():
+                continue  # Waiter was cancelled
+            self._grant(queue)
+            future.set_result(None)
+            self._publish(queue)
+
+    async def acquire(self, name: str) -> None:
+        queue = self._classes[name]
+        started = time.monotonic()
+        if not any(q.waiters for q in self._classes.values()) and self._eligible(queue):
+            self._grant(queue)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            queue.waiters.append((started, future))
+            # Other classes may be waiting on their caps while this one has room
+            self._dispatch()
+            self._publish(queue)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Granted just before the cancellation landed
+                    self.release(name)
+                else:
+                    queue.waiters = deque(w for w in queue.waiters if w[1] is not future)
+                    self._publish(queue)
+                raise
+        metrics.observe("scheduler_wait_seconds", time.monotonic() - started, buckets=WAIT_BUCKETS, update_class=name)
+
+    def release(self, name: str) -> None:
+        queue = self._classes[name]
+        self.running -= 1
+        queue.running -= 1
+        self._dispatch()
+        self._publish(queue)
+
+    @asynccontextmanager
+    async def slot(self, name: str):
+        await self.acquire(name)
+        try:
+            yield
+        finally:
+            self.release(name)
+
+    def _publish(self, queue: _ClassQueue) -> None:
+        metrics.set_gauge("scheduler_queued", len(queue.waiters), update_class=queue.name)
+        metrics.set_gauge("scheduler_running", queue.running, update_class=queue.name)
+
+    def stats(self) -> dict:
+        return {
+            name: {"running": q.running, "queued": len(q.waiters), "limit": q.limit, "weight": q.weight}
+            for name, q in self._classes.items()
+        }
@@ -0,0 +1,97 @@
+"""
+Single-flight coalescing of identical in-flight requests
+"""
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List
+from bot.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class _SharedStream:
+    """Buffer of chunks from one generator, replayed to every subscriber"""
+
+    def __init__(self):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.changed = asyncio.Condition()
+        self.task: asyncio.Future | None = None
+
+class SingleFlight:
+    """Merge concurrent calls that share a key into one upstream call
+
+    The first caller for a key runs the work; callers arriving while it is in
+    flight await the same result (or exception). The work runs in its own
+    task, shielded from any single waiter being cancelled.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, _SharedStream] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run `fn` once for all concurrent callers with the same key"""
+        future = self._calls.get(key)
+        if future is not None:
+            metrics.inc("singleflight_requests_total", flight=self.name, result="coalesced")
+            return await asyncio.shield(future)
+
+        metrics.inc("singleflight_requests_total", flight=self.name, result="leader")
+        future = asyncio.ensure_future(fn())
+        self._calls[key] = future
+
+        def _forget(done: asyncio.Future) -> None:
+            if self._calls.get(key) is done:
+                del self._calls[key]
+            if not done.cancelled():
+                done.exception()  # Mark retrieved so unobserved errors aren't logged twice
+
+        future.add_done_callback(_forget)
+        return await asyncio.shield(future)
+
+    async def stream(self, key: str, fn: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """Share one async generator between concurrent callers with the same key
+
+        Callers that join late first receive the chunks already produced, then
+        follow the live stream.
+        """
+        shared = self._streams.get(key)
+        if shared is None:
+            metrics.inc("singleflight_requests_total", flight=self.name, result="leader")
+            shared = self._streams[key] = _SharedStream()
+            shared.task = asyncio.ensure_future(self._pump(key, shared, fn))
+        else:
+            metrics.inc("singleflight_requests_total", flight=self.name, result="coalesced")
+
+        index = 0
+        while True:
+            async with shared.changed:
+                await shared.changed.wait_for(lambda: index < len(shared.chunks) or shared.done)
+                pending = shared.chunks[index:]
+                finished = shared.done
+            for chunk in pending:
+                yield chunk
+            index += len(pending)
+            if finished and index >= len(shared.chunks):
+                break
+
+        if shared.error is not None:
+            raise shared.error
+
+    async def _pump(self, key: str, shared: _SharedStream, fn: Callable[[], AsyncIterator[Any]]) -> None:
+        """Drive the leader's generator and publish each chunk to subscribers"""
+        try:
+            async for chunk in fn():
+                async with shared.changed:
+                    shared.chunks.append(chunk)
+                    shared.changed.notify_all()
+        except Exception as e:
+            shared.error = e
+        finally:
+            if self._streams.get(key) is shared:
+                del self._streams[key]
+            async with shared.changed:
+                shared.done = True
+                shared.changed.notify_all()
@@ -0,0 +1,129 @@
+"""
+Incremental Telegram replies for streamed AI output
+"""
+import asyncio
+import logging
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+from telegram import Message
+from telegram.constants import ChatType, MessageLimit
+from telegram.error import BadRequest
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Last edit/send time per chat, shared by all streams so concurrent replies in one chat stay under the limit
+_last_edit_at: Dict[int, float] = {}
+
+# Prune _last_edit_at once it tracks this many chats
+MAX_TRACKED_CHATS = 1024
+
+# Telegram (legacy) Markdown entity markers; a run such as ** or ``` opens or closes one entity
+_MARKUP = ('*', '_', '`')
+_MARKUP_RUNS = re.compile(r'\*+|_+|`+')
+
+def _note_edit(chat_id: int) -> None:
+    now = time.monotonic()
+    _last_edit_at[chat_id] = now
+    if len(_last_edit_at) > MAX_TRACKED_CHATS:
+        # An entry older than the longest interval no longer delays anything
+        horizon = now - max(Config.STREAM_EDIT_INTERVAL_PRIVATE, Config.STREAM_EDIT_INTERVAL_GROUP)
+        for chat, at in list(_last_edit_at.items()):
+            if at < horizon:
+                del _last_edit_at[chat]
+
+def _balanced_markup(text: str) -> bool:
+    """Whether every Markdown entity in a partial reply is closed"""
+    runs = _MARKUP_RUNS.findall(text)
+    return all(sum(1 for run in runs if run[0] == marker) % 2 == 0 for marker in _MARKUP)
+
+def _strip_markup(text: str) -> str:
+    for marker in _MARKUP:
+        text = text.replace(marker, '')
+    return text
+
+def split_message(text: str, max_length: int = MessageLimit.MAX_TEXT_LENGTH) -> List[str]:
+    """Split text into Telegram-sized pages, preferring newline or word boundaries"""
+    pages = []
+    while len(text) > max_length:
+        cut = text.rfind('\n', 0, max_length)
+        if cut < max_length * 0.8:
+            cut = text.rfind(' ', 0, max_length)
+        if cut < max_length * 0.8:
+            cut = max_length
+        pages.append(text[:cut])
+        text = text[cut:].lstrip('\n ')
+    pages.append(text)
+    return pages
+
+class StreamingReply:
+    """Send a reply as soon as text arrives and keep editing it, one message per 4096 characters"""
+
+    def __init__(self, message: Message, prefix: str = "", parse_mode: Optional[str] = None):
+        self.message = message
+        self.prefix = prefix
+        self.parse_mode = parse_mode
+        self.chat_id = message.chat_id
+        if message.chat.type == ChatType.PRIVATE:
+            self.interval = Config.STREAM_EDIT_INTERVAL_PRIVATE
+        else:
+            self.interval = Config.STREAM_EDIT_INTERVAL_GROUP
+
+        self.text = ""
+        self._sent: List[Message] = []
+        self._rendered: List[Optional[Tuple[str, Optional[str]]]] = []
+
+    def _ready(self) -> bool:
+        """Whether the per-chat edit interval has elapsed"""
+        return time.monotonic() - _last_edit_at.get(self.chat_id, 0.0) >= self.interval
+
+    async def push(self, chunk: str) -> None:
+        """Append a chunk, flushing immediately for the first one and then at most once per interval"""
+        self.text += chunk
+        if not self._sent or self._ready():
+            await self._flush()
+
+    async def finish(self) -> None:
+        """Flush the remaining text, applying the parse mode to the final version"""
+        if not self.text:
+            self.text = "I'm sorry, I couldn't generate a response for that."
+
+        wait = self.interval - (time.monotonic() - _last_edit_at.get(self.chat_id, 0.0))
+        if self._sent and wait > 0:
+            await asyncio.sleep(wait)
+        await self._flush(final=True)
+
+    async def _render(self, i: int, text: str, parse_mode: Optional[str]) -> None:
+        if i < len(self._sent):
+            await self._sent[i].edit_text(text, parse_mode=parse_mode)
+        else:
+            self._sent.append(await self.message.reply_text(text, parse_mode=parse_mode))
+            self._rendered.append(None)
+
+    async def _flush(self, final: bool = False) -> None:
+        """Bring the sent messages in line with the accumulated text"""
+        pages = split_message(self.prefix + self.text)
+
+        for i, page in enumerate(pages):
+            text, parse_mode = page, self.parse_mode
+            if parse_mode and not final and not _balanced_markup(page):
+                # A half-streamed entity would be rejected or shown literally; preview without markup
+                text, parse_mode = _strip_markup(page), None
+            if i < len(self._rendered) and self._rendered[i] == (text, parse_mode):
+                continue
+
+            try:
+                await self._render(i, text, parse_mode)
+            except BadRequest as e:
+                if parse_mode is None or "not modified" in str(e).lower():
+                    logger.debug(f"Skipping streamed message update: {e}")
+                    if i >= len(self._sent):
+                        break
+                    continue
+                # Model output can be invalid markdown even when balanced; fall back to plain text
+                text, parse_mode = (page if final else _strip_markup(page)), None
+                await self._render(i, text, parse_mode)
+
+            self._rendered[i] = (text, parse_mode)
+            _note_edit(self.chat_id)
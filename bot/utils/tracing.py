@@ -0,0 +1,213 @@
+"""
+Lightweight per-update tracing with an in-memory ring buffer and JSONL exporter
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from telegram.request import HTTPXRequest
+from bot.utils.metrics import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class Span:
+    """One timed operation inside a trace"""
+
+    __slots__ = ("name", "span_id", "parent_id", "start", "end", "attrs", "error")
+
+    def __init__(self, name: str, span_id: str, parent_id: Optional[str], attrs: dict):
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attrs = attrs
+        self.error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.time()
+        return round((end - self.start) * 1000, 2)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration_ms": self.duration_ms,
+            "attrs": self.attrs,
+            "error": self.error,
+        }
+
+class Trace:
+    """All spans recorded while handling one update"""
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: List[Span] = []
+        self._next_id = 0
+
+    def new_span(self, name: str, parent_id: Optional[str], attrs: dict) -> Span:
+        self._next_id += 1
+        span = Span(name, f"{self._next_id:x}", parent_id, attrs)
+        self.spans.append(span)
+        return span
+
+    @property
+    def root(self) -> Span:
+        return self.spans[0]
+
+    def to_dict(self) -> dict:
+        root = self.root
+        return {
+            "trace_id": self.trace_id,
+            "name": root.name,
+            "start": root.start,
+            "duration_ms": root.duration_ms,
+            "error": root.error,
+            "spans": [span.to_dict() for span in self.spans],
+        }
+
+    def format_tree(self) -> str:
+        """Indented span tree, children in start order"""
+        children: Dict[Optional[str], List[Span]] = {}
+        for span in self.spans:
+            children.setdefault(span.parent_id, []).append(span)
+
+        lines = []
+        def _walk(span: Span, depth: int) -> None:
+            attrs = " ".join(f"{k}={v}" for k, v in span.attrs.items())
+            error = f" ERROR: {span.error}" if span.error else ""
+            lines.append(f"{'  ' * depth}{span.name} {span.duration_ms:.1f}ms {attrs}{error}".rstrip())
+            for child in sorted(children.get(span.span_id, []), key=lambda s: s.start):
+                _walk(child, depth + 1)
+
+        _walk(self.root, 0)
+        return "\n".join(lines)
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+class TraceExporter:
+    """Keep finished traces in a ring buffer and optionally append them to a JSONL file"""
+
+    def __init__(self, size: int, path: Optional[str] = None):
+        self.traces = deque(maxlen=size)
+        self.path = path
+
+    def export(self, trace: Trace) -> None:
+        self.traces.append(trace)
+        if self.path:
+            line = json.dumps(trace.to_dict(), default=str) + "\n"
+            # File I/O stays off the event loop
+            asyncio.get_running_loop().run_in_executor(None, self._append, line)
+
+    def _append(self, line: str) -> None:
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            logger.warning(f"Failed to write trace to {self.path}: {e}")
+
+    def find(self, trace_id: str) -> Optional[Trace]:
+        for trace in self.traces:
+            if trace.trace_id == trace_id:
+                return trace
+        return None
+
+    def recent(self, limit: int = 50, min_ms: float = 0, name: Optional[str] = None) -> List[dict]:
+        """Newest first, optionally only slower than `min_ms` or for one handler"""
+        result = []
+        for trace in reversed(self.traces):
+            if trace.root.duration_ms < min_ms or (name and trace.root.name != name):
+                continue
+            result.append(trace.to_dict())
+            if len(result) >= limit:
+                break
+        return result
+
+exporter = TraceExporter(Config.TRACE_BUFFER_SIZE, Config.TRACE_EXPORT_PATH or None)
+
+@contextmanager
+def start_trace(name: str, **attrs):
+    """Open the root span of a new trace for one update
+
+    When the root span closes the trace is exported, and logged as a span
+    tree if it took longer than Config.SLOW_REQUEST_THRESHOLD seconds.
+    """
+    trace = Trace(os.urandom(8).hex())
+    root = trace.new_span(name, None, attrs)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        root.end = time.time()
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        exporter.export(trace)
+        if root.duration_ms >= Config.SLOW_REQUEST_THRESHOLD * 1000:
+            logger.warning(f"Slow update ({root.duration_ms:.0f}ms) trace={trace.trace_id}\n{trace.format_tree()}")
+
+@contextmanager
+def span(name: str, **attrs):
+    """Record a child span of the current span; a no-op outside a trace"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    parent = _current_span.get()
+    current = trace.new_span(name, parent.span_id if parent else None, attrs)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end = time.time()
+        _current_span.reset(token)
+
+def track_handler(handler):
+    """Decorate a Telegram handler to trace it and record its latency, escaped errors and in-flight updates"""
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        name = handler.__name__
+        metrics.add_gauge("updates_in_flight", 1)
+        started = time.monotonic()
+        try:
+            chat_id = update.effective_chat.id if update.effective_chat else None
+            with start_trace(name, update_id=update.update_id, chat_id=chat_id):
+                return await handler(update, context)
+        except Exception:
+            metrics.inc("handler_exceptions_total", handler=name)
+            raise
+        finally:
+            metrics.observe("handler_latency_seconds", time.monotonic() - started, handler=name)
+            metrics.add_gauge("updates_in_flight", -1)
+    return wrapper
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace else None
+
+class TracingRequest(HTTPXRequest):
+    """Bot API request backend that records a span per call (e.g. telegram.sendPhoto)"""
+
+    async def do_request(self, url: str, method: str, request_data=None, **kwargs):
+        # The URL carries the bot token, so only the API method name is recorded
+        name = "download_file" if "/file/bot" in url else url.rsplit("/", 1)[-1]
+        with span(f"telegram.{name}"):
+            return await super().do_request(url, method, request_data, **kwargs)
@@ -0,0 +1,110 @@
+"""
+Concurrent update processing with per-chat ordering
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Deque, Dict, Hashable, Optional, Tuple
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from bot.utils.metrics import metrics
+from bot.utils.scheduler import PriorityScheduler, classify_update
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Process updates from different chats in parallel, and each chat's updates in order
+
+    Every chat gets its own FIFO queue, drained by a worker task that exists
+    only while the chat has pending updates. At most `max_running` updates
+    run at once across all chats; a chat waiting for its turn (or for a free
+    slot) holds no running slot, so one busy chat cannot starve the others.
+    Running slots are handed out by a PriorityScheduler, so cheap commands
+    overtake queued media jobs from other chats.
+    `max_pending` bounds how many updates may be admitted (queued or
+    running) before the application itself waits.
+
+    Updates without a chat (inline queries, poll answers, ...) are sharded
+    by user, and those with neither run unordered.
+    """
+
+    def __init__(self, max_running: int, max_pending: Optional[int] = None):
+        # The base class semaphore is the admission limit; it is acquired
+        # without suspending while there is room, so updates reach the chat
+        # queues in the order the application created them
+        super().__init__(max_pending or max(max_running, Config.MAX_PENDING_UPDATES))
+        self.max_running = max_running
+        self.scheduler = PriorityScheduler(max_running, Config.SCHEDULER_CLASSES, Config.SCHEDULER_AGING)
+        self._queues: Dict[Hashable, Deque[Tuple[object, Awaitable[Any], asyncio.Future]]] = {}
+        self._workers: Dict[Hashable, asyncio.Task] = {}
+
+    @staticmethod
+    def shard_key(update: object) -> Optional[Hashable]:
+        """The ordering key for an update: its chat, else its user"""
+        if isinstance(update, Update):
+            if update.effective_chat is not None:
+                return ("chat", update.effective_chat.id)
+            if update.effective_user is not None:
+                return ("user", update.effective_user.id)
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self.shard_key(update)
+        if key is None:
+            async with self.scheduler.slot(classify_update(update)):
+                await coroutine
+            return
+
+        # Enqueue before the first await so arrival order is preserved
+        done = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            self._workers[key] = asyncio.ensure_future(self._drain(key, queue))
+        queue.append((update, coroutine, done))
+        metrics.set_gauge("update_chat_queues", len(self._queues))
+        await done
+
+    async def _drain(self, key: Hashable, queue: Deque[Tuple[object, Awaitable[Any], asyncio.Future]]) -> None:
+        """Run one chat's updates strictly one after another"""
+        try:
+            while queue:
+                update, coroutine, done = queue.popleft()
+                try:
+                    async with self.scheduler.slot(classify_update(update)):
+                        metrics.add_gauge("updates_running", 1)
+                        try:
+                            await coroutine
+                        finally:
+                            metrics.add_gauge("updates_running", -1)
+                except Exception as e:
+                    if not done.done():
+                        done.set_exception(e)
+                else:
+                    if not done.done():
+                        done.set_result(None)
+        finally:
+            # Only reached with items left if the worker was cancelled
+            for _, coroutine, done in queue:
+                coroutine.close()
+                done.cancel()
+            del self._queues[key]
+            del self._workers[key]
+            metrics.set_gauge("update_chat_queues", len(self._queues))
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        """Wait for every chat's queued updates to finish"""
+        if self._workers:
+            await asyncio.gather(*self._workers.values(), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "max_running": self.max_running,
+            "chats_queued": len(self._queues),
+            "updates_queued": sum(len(queue) for queue in self._queues.values()),
+            "classes": self.scheduler.stats(),
+        }
@@ -0,0 +1,120 @@
+"""
+Cold-start warmup: module preloading, DNS resolution and pooled connections
+"""
+import asyncio
+import importlib
+import logging
+import os
+import time
+from typing import Awaitable, Dict, List, Optional
+from urllib.parse import urlparse
+from bot.utils.http_client import get_http_client
+from bot.utils.importtime import import_timer
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# service -> (SDK modules to preload, URL to warm, whether calls go through our HTTP pool)
+WARMUP_TARGETS = {
+    "gemini": (["google.genai"], "https://generativelanguage.googleapis.com/", False),
+    "vision": (["google.cloud.vision"], "https://vision.googleapis.com/", False),
+    "youtube": ([], "https://www.googleapis.com/", True),
+    "tmdb": ([], "https://api.themoviedb.org/", True),
+    "removebg": ([], "https://api.remove.bg/", True),
+}
+
+class Warmup:
+    """Background warmup run once at startup; `ready` flips when it finishes
+
+    For every enabled service it preloads the service module and its SDK in a
+    worker thread, pre-opens a pooled connection (DNS, TCP, TLS) to its API,
+    or only resolves the host for SDKs that bring their own HTTP stack, and
+    then builds the service. Failures are logged and recorded but never keep
+    the bot from becoming ready; neither does a warmup slower than
+    Config.WARMUP_TIMEOUT.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.steps: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self.duration: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, services=None) -> asyncio.Task:
+        """Start warming up the registry's services in the background (idempotent)"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run(services))
+        return self._task
+
+    async def run(self, services=None) -> None:
+        started = time.monotonic()
+        try:
+            if Config.WARMUP_ENABLED:
+                await asyncio.wait_for(self._run_steps(services), timeout=Config.WARMUP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Warmup still running after {Config.WARMUP_TIMEOUT}s, reporting ready anyway")
+        except Exception as e:
+            logger.error(f"Warmup failed: {e}")
+        finally:
+            self.duration = time.monotonic() - started
+            self.ready = True
+            logger.info(f"Warmup finished in {self.duration:.2f}s ({len(self.steps)} steps, {len(self.errors)} errors)")
+            import_timer.log_report()
+
+    async def _step(self, name: str, work: Awaitable) -> None:
+        started = time.monotonic()
+        try:
+            await work
+        except Exception as e:
+            self.errors[name] = str(e)
+            logger.warning(f"Warmup step {name} failed: {e}")
+        finally:
+            self.steps[name] = round(time.monotonic() - started, 3)
+
+    async def _run_steps(self, services) -> None:
+        names = [name for name in WARMUP_TARGETS if services is not None and services.is_enabled(name)]
+
+        modules: List[str] = []
+        for name in names:
+            sdk_modules, _, _ = WARMUP_TARGETS[name]
+            if name == "vision" and not os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
+                sdk_modules = []  # Vision falls back to Gemini and never imports the SDK
+            modules += sdk_modules + [services.specs[name][0]]
+
+        steps = [self._step("preload_modules", asyncio.to_thread(self._preload, modules))]
+        for name in names:
+            _, url, pooled = WARMUP_TARGETS[name]
+            if pooled:
+                steps.append(self._step(f"connect:{urlparse(url).hostname}", get_http_client().warm(url, timeout=Config.WARMUP_TIMEOUT)))
+            else:
+                steps.append(self._step(f"resolve:{urlparse(url).hostname}", self._resolve(url)))
+        await asyncio.gather(*steps)
+
+        # Modules are loaded, so building the services is now cheap and runs on the loop
+        for name in names:
+            await self._step(f"service:{name}", self._build(services, name))
+
+    @staticmethod
+    def _preload(modules: List[str]) -> None:
+        for module in dict.fromkeys(modules):
+            importlib.import_module(module)
+
+    @staticmethod
+    async def _resolve(url: str) -> None:
+        parsed = urlparse(url)
+        await asyncio.get_running_loop().getaddrinfo(parsed.hostname, parsed.port or 443)
+
+    @staticmethod
+    async def _build(services, name: str) -> None:
+        services.get(name)
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "duration": round(self.duration, 3) if self.duration is not None else None,
+            "steps": self.steps,
+            "errors": self.errors,
+        }
+
+warmup = Warmup()
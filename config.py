@@ -3,6 +3,11 @@ Configuration settings for the Telegram Bot
 """
 import os
 
+def _bulkhead_limits(name: str, default: str) -> tuple:
+    """Parse "max_concurrent,max_queue,queue_timeout" from BULKHEAD_<NAME>"""
+    max_concurrent, max_queue, queue_timeout = os.getenv(f"BULKHEAD_{name.upper()}", default).split(",")
+    return int(max_concurrent), int(max_queue), float(queue_timeout)
+
 class Config:
     """Configuration class for API keys and settings"""
     
@@ -28,3 +33,137 @@ class Config:
     MAX_FILE_SIZE = 20 * 1024 * 1024  # 20MB
     SUPPORTED_IMAGE_FORMATS = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']
     SUPPORTED_VIDEO_FORMATS = ['.mp4', '.avi', '.mov', '.mkv', '.wmv']
+    
+    # Shared HTTP connection pool
+    HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+    HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+    HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "60"))
+    HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+    HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+    
+    # Streaming AI replies
+    GEMINI_STREAMING = os.getenv("GEMINI_STREAMING", "true").lower() == "true"
+    STREAM_EDIT_INTERVAL_PRIVATE = float(os.getenv("STREAM_EDIT_INTERVAL_PRIVATE", "1.0"))
+    STREAM_EDIT_INTERVAL_GROUP = float(os.getenv("STREAM_EDIT_INTERVAL_GROUP", "3.0"))
+    GEMINI_STREAM_IDLE_TIMEOUT = float(os.getenv("GEMINI_STREAM_IDLE_TIMEOUT", "30"))  # Max seconds between streamed chunks
+    
+    # Response caches (set CACHE_DB_PATH to persist them across restarts)
+    CACHE_DB_PATH = os.getenv("CACHE_DB_PATH")
+    CACHE_FLUSH_INTERVAL = float(os.getenv("CACHE_FLUSH_INTERVAL", "1.0"))  # Seconds between batched writes
+    TMDB_QUERY_CACHE_SIZE = int(os.getenv("TMDB_QUERY_CACHE_SIZE", "2000"))
+    TMDB_QUERY_CACHE_TTL = int(os.getenv("TMDB_QUERY_CACHE_TTL", str(6 * 3600)))
+    TMDB_DETAILS_CACHE_SIZE = int(os.getenv("TMDB_DETAILS_CACHE_SIZE", "1000"))
+    TMDB_DETAILS_CACHE_TTL = int(os.getenv("TMDB_DETAILS_CACHE_TTL", str(24 * 3600)))
+    YOUTUBE_SEARCH_CACHE_SIZE = int(os.getenv("YOUTUBE_SEARCH_CACHE_SIZE", "2000"))
+    YOUTUBE_SEARCH_CACHE_TTL = int(os.getenv("YOUTUBE_SEARCH_CACHE_TTL", "3600"))
+    YOUTUBE_STATS_CACHE_SIZE = int(os.getenv("YOUTUBE_STATS_CACHE_SIZE", "10000"))
+    YOUTUBE_STATS_CACHE_TTL = int(os.getenv("YOUTUBE_STATS_CACHE_TTL", "600"))
+    
+    # YouTube Data API quota (units per day, reset at midnight Pacific time)
+    YOUTUBE_DAILY_QUOTA = int(os.getenv("YOUTUBE_DAILY_QUOTA", "10000"))
+    YOUTUBE_QUOTA_RESERVE = float(os.getenv("YOUTUBE_QUOTA_RESERVE", "0.1"))
+    
+    # Image/video analysis cache, keyed by Telegram file_unique_id or content hash
+    ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "5000"))
+    ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", str(7 * 24 * 3600)))
+    DEGRADED_ANALYSIS_TTL = int(os.getenv("DEGRADED_ANALYSIS_TTL", "600"))  # When Vision or Gemini failed
+    
+    # Near-duplicate image matching (requires Pillow)
+    PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "6"))
+    PHASH_INDEX_SIZE = int(os.getenv("PHASH_INDEX_SIZE", "200000"))
+    
+    # Media buffering: uploads above the threshold are spilled to MEDIA_SPILL_DIR (e.g. /dev/shm)
+    MEDIA_SPILL_THRESHOLD = int(os.getenv("MEDIA_SPILL_THRESHOLD", str(8 * 1024 * 1024)))
+    MEDIA_SPILL_DIR = os.getenv("MEDIA_SPILL_DIR") or None
+    
+    # Per-backend bulkheads: (max concurrent calls, max queued calls, queue timeout in seconds)
+    BULKHEADS = {
+        "gemini_text": _bulkhead_limits("gemini_text", "32,128,10"),
+        "gemini_vision": _bulkhead_limits("gemini_vision", "8,32,20"),
+        "vision_api": _bulkhead_limits("vision_api", "16,64,10"),
+        "youtube": _bulkhead_limits("youtube", "16,64,5"),
+        "tmdb": _bulkhead_limits("tmdb", "16,64,5"),
+        "removebg": _bulkhead_limits("removebg", "4,16,15"),
+    }
+    
+    # Upstream resilience: (per-call timeout in seconds, max retries)
+    RESILIENCE = {
+        "gemini_text": (float(os.getenv("GEMINI_TEXT_TIMEOUT", "30")), 1),
+        "gemini_vision": (float(os.getenv("GEMINI_VISION_TIMEOUT", "90")), 1),
+        "vision_api": (float(os.getenv("VISION_API_TIMEOUT", "20")), 1),
+        "youtube": (float(os.getenv("YOUTUBE_TIMEOUT", "10")), 1),
+        "tmdb": (float(os.getenv("TMDB_TIMEOUT", "10")), 2),
+        "removebg": (float(os.getenv("REMOVEBG_TIMEOUT", "30")), 1),
+    }
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+    CIRCUIT_RECOVERY_TIMEOUT = float(os.getenv("CIRCUIT_RECOVERY_TIMEOUT", "30"))
+    RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+    RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.2"))
+    RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "2.0"))
+    
+    # Adaptive timeouts and hedging (Config.RESILIENCE timeouts become the ceiling)
+    LATENCY_WINDOW_SIZE = int(os.getenv("LATENCY_WINDOW_SIZE", "200"))
+    LATENCY_MIN_SAMPLES = int(os.getenv("LATENCY_MIN_SAMPLES", "20"))
+    ADAPTIVE_TIMEOUT_PERCENTILE = float(os.getenv("ADAPTIVE_TIMEOUT_PERCENTILE", "0.99"))
+    ADAPTIVE_TIMEOUT_MULTIPLIER = float(os.getenv("ADAPTIVE_TIMEOUT_MULTIPLIER", "3.0"))
+    ADAPTIVE_TIMEOUT_MIN = float(os.getenv("ADAPTIVE_TIMEOUT_MIN", "2.0"))
+    HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+    
+    # Cold-start warmup (/health reports not-ready until it finishes)
+    WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+    WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "20"))
+    
+    # Metrics
+    LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+    LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD", "0.1"))  # Seconds before a stall's stack is captured
+    
+    # Tracing and admin endpoints
+    TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "500"))
+    TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")  # JSONL file; empty keeps traces in memory only
+    SLOW_REQUEST_THRESHOLD = float(os.getenv("SLOW_REQUEST_THRESHOLD", "5.0"))
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # Admin endpoints are disabled when unset
+    PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+    PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.01"))
+    TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", "10"))
+    
+    # Update processing: chats run in parallel, each chat's updates in order
+    MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
+    MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", "1000"))
+    
+    # Update scheduling by cost class: (weight, max share of MAX_CONCURRENT_UPDATES, reserved slots)
+    SCHEDULER_CLASSES = {
+        "static": (8.0, 1.0, int(os.getenv("SCHEDULER_STATIC_RESERVED", "2"))),
+        "search": (4.0, 1.0, 0),
+        "llm": (2.0, 0.75, 0),
+        "media": (1.0, float(os.getenv("SCHEDULER_MEDIA_SHARE", "0.5")), 0),
+    }
+    SCHEDULER_AGING = float(os.getenv("SCHEDULER_AGING", "10"))  # Seconds before any waiter jumps the weights
+    
+    # Durable background jobs (video analysis, background removal)
+    JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs.db")
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "5"))  # Base backoff in seconds, doubled per attempt
+    JOB_RETENTION = int(os.getenv("JOB_RETENTION", "86400"))  # Seconds to keep finished jobs
+    
+    # Outbound Telegram rate limits, set a little under the flood limits
+    # (~30 msg/s overall, ~1 msg/s per chat, 20 msg/min per group)
+    TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "25"))  # Per second; 0 disables
+    TG_GLOBAL_BURST = float(os.getenv("TG_GLOBAL_BURST", "5"))
+    TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+    TG_CHAT_BURST = float(os.getenv("TG_CHAT_BURST", "3"))
+    TG_GROUP_PER_MINUTE = float(os.getenv("TG_GROUP_PER_MINUTE", "18"))
+    TG_GROUP_BURST = float(os.getenv("TG_GROUP_BURST", "2"))
+    TG_MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "2"))  # Retries after a 429, each after its retry_after
+    TG_CHAT_ACTION_TTL = float(os.getenv("TG_CHAT_ACTION_TTL", "4"))  # Telegram shows an action for ~5s
+    TG_CHAT_ACTION_MAX_DELAY = float(os.getenv("TG_CHAT_ACTION_MAX_DELAY", "1"))
+    
+    # Telegram file_ids of sent photos (posters, remove.bg results), reused instead of refetching/reuploading
+    FILE_ID_CACHE_SIZE = int(os.getenv("FILE_ID_CACHE_SIZE", "10000"))
+    FILE_ID_CACHE_TTL = int(os.getenv("FILE_ID_CACHE_TTL", str(30 * 24 * 3600)))
+    FILE_ID_CACHE_DB_PATH = os.getenv("FILE_ID_CACHE_DB_PATH", CACHE_DB_PATH)
+    
+    # Webhook server (webhook_server.py)
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "5000"))
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # Public URL; defaults to https://$RENDER_EXTERNAL_HOSTNAME/webhook
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # Checked against X-Telegram-Bot-Api-Secret-Token when set
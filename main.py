@@ -6,9 +6,16 @@ Adapted for Render.com deployment
 
 import logging
 import os
+# Installed before the telegram imports so they show up in the import-time report
+from bot.utils.importtime import import_timer
+import_timer.install()
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
 from telegram import Update
 from telegram.ext import ContextTypes
+from bot.utils.rate_limiter import rate_limiter
+from bot.utils.update_processor import ChatOrderedUpdateProcessor
+from bot.utils.warmup import warmup
+from config import Config
 
 # Enable logging
 logging.basicConfig(
@@ -17,6 +24,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def post_init(application: Application):
+    """Warm up in the background once the event loop is running"""
+    # These handlers use no upstream services, so warmup only reports import times
+    warmup.start()
+
 # Handlers (simplified examples - you should implement these properly)
 async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Hello! I'm your AI assistant bot.")
@@ -36,7 +48,15 @@ def main():
         return
 
     # Create application
-    application = Application.builder().token(bot_token).build()
+    # Updates from different chats are handled concurrently, each chat's in order
+    application = (
+        Application.builder()
+        .token(bot_token)
+        .concurrent_updates(ChatOrderedUpdateProcessor(Config.MAX_CONCURRENT_UPDATES))
+        .rate_limiter(rate_limiter)
+        .post_init(post_init)
+        .build()
+    )
 
     # Add command handlers
     application.add_handler(CommandHandler("start", start_handler))
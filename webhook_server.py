@@ -4,16 +4,37 @@ Enhanced webhook server with status endpoint, static file server, and Telegram b
 Modified to use port 5000 as default
 """
 
+import hmac
+import json
 import logging
 import os
 import asyncio
+import time
+from typing import Optional
+# Installed before the heavy imports below so they show up in the import-time report
+from bot.utils.importtime import import_timer
+import_timer.install()
 from tornado.web import Application as TornadoApp, RequestHandler, StaticFileHandler
-from tornado.platform.asyncio import AsyncIOMainLoop
+from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
 from bot.handlers import (
     start_handler, help_handler, gemini_handler, youtube_handler,
-    movie_handler, removebg_handler, vision_handler, text_handler
+    movie_handler, removebg_handler, vision_handler, text_handler, register_jobs
 )
+from bot.services.registry import services
+from bot.utils.bulkhead import bulkhead_stats
+from bot.utils.file_ids import file_id_cache
+from bot.utils.http_client import close_http_client, get_http_client
+from bot.utils.jobs import job_queue
+from bot.utils.loop_monitor import loop_monitor
+from bot.utils.metrics import metrics
+from bot.utils.rate_limiter import rate_limiter
+from bot.utils.profiler import ProfilerBusyError, profile_cpu, profile_memory
+from bot.utils.resilience import circuit_states, latency_stats
+from bot.utils.tracing import TracingRequest, exporter
+from bot.utils.update_processor import ChatOrderedUpdateProcessor
+from bot.utils.warmup import warmup
+from config import Config
 
 # Enable logging
 logging.basicConfig(
@@ -24,12 +45,15 @@ logger = logging.getLogger(__name__)
 
 class StatusHandler(RequestHandler):
     """Status endpoint for bot health check"""
-    def get(self):
+    def initialize(self, bot_application: Application):
+        self.bot_application = bot_application
+
+    async def get(self):
         self.set_header("Content-Type", "application/json")
         self.write({
             "status": "online",
             "bot": "Telegram AI Bot",
-            "webhook": f"https://{os.getenv('RENDER_EXTERNAL_HOSTNAME', 'localhost')}:5000/webhook",
+            "webhook": webhook_url(),
             "features": [
                 "AI Assistant (Gemini)",
                 "YouTube Search", 
@@ -38,14 +62,175 @@ class StatusHandler(RequestHandler):
                 "Enhanced Image Analysis (Vision API + Gemini)",
                 "Static File Server"
             ],
-            "version": "2.1.0"
+            "version": "2.1.0",
+            "http_pool": get_http_client().stats(),
+            "bulkheads": bulkhead_stats(),
+            "circuits": circuit_states(),
+            "latency": latency_stats(),
+            "services": services.status(),
+            "warmup": warmup.stats(),
+            "jobs": await job_queue.stats(),
+            "telegram_rate_limiter": rate_limiter.stats(),
+            "update_processor": self._update_processor_stats(),
+            "event_loop": loop_monitor.stats(),
+            "imports": {"total_ms": import_timer.total_ms(), "slowest": import_timer.report(10, top_level=True)},
+            "caches": self._cache_stats()
         })
 
+    def _update_processor_stats(self) -> Optional[dict]:
+        processor = self.bot_application.update_processor
+        return processor.stats() if isinstance(processor, ChatOrderedUpdateProcessor) else None
+
+    @staticmethod
+    def _cache_stats() -> dict:
+        """Cache stats for services that have been built (never forces a cold service to load)"""
+        caches = {}
+        for name in ("tmdb", "youtube"):
+            service = services.peek(name)
+            if service is not None:
+                caches[name] = service.cache_stats()
+        vision = services.peek("vision")
+        if vision is not None:
+            caches["vision"] = vision.analysis_cache.stats()
+        caches["telegram_file_ids"] = file_id_cache.stats()
+        return caches
+
+async def flush_caches() -> None:
+    """Write batched cache entries to SQLite before exit (services that were never built have none)"""
+    caches = {
+        "tmdb": ("query_cache", "details_cache"),
+        "youtube": ("search_cache", "stats_cache"),
+        "vision": ("analysis_cache", "phash_cache"),
+    }
+    flushes = [file_id_cache.flush]
+    for name, attrs in caches.items():
+        service = services.peek(name)
+        if service is not None:
+            flushes.extend(getattr(service, attr).flush for attr in attrs)
+    for flush in flushes:
+        try:
+            await asyncio.to_thread(flush)
+        except Exception as e:
+            logger.error(f"Flushing a cache at shutdown failed: {e}")
+
+class MetricsHandler(RequestHandler):
+    """Prometheus scrape endpoint"""
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(metrics.render_prometheus())
+
+class AdminHandler(RequestHandler):
+    """Base for admin endpoints: require `Authorization: Bearer <ADMIN_TOKEN>`, hidden when no token is set"""
+    def prepare(self):
+        if not Config.ADMIN_TOKEN:
+            self.send_error(404)
+            return
+        supplied = self.request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        if not hmac.compare_digest(supplied.encode(), Config.ADMIN_TOKEN.encode()):
+            self.send_error(401)
+
+class TracesHandler(AdminHandler):
+    """Recent traces (newest first) or one full trace by id"""
+    def get(self, trace_id=None):
+        if trace_id:
+            trace = exporter.find(trace_id)
+            if trace is None:
+                self.send_error(404)
+                return
+            self.write({**trace.to_dict(), "tree": trace.format_tree()})
+            return
+        self.write({"traces": exporter.recent(
+            limit=int(self.get_argument("limit", "50")),
+            min_ms=float(self.get_argument("min_ms", "0")),
+            name=self.get_argument("handler", None),
+        )})
+
+class CpuProfileHandler(AdminHandler):
+    """Sample all threads for ?seconds= and return a collapsed-stack file for flame graphs"""
+    async def get(self):
+        try:
+            folded = await profile_cpu(
+                float(self.get_argument("seconds", "10")),
+                float(self.get_argument("interval", "0")) or None,
+                include_idle=self.get_argument("idle", "0") == "1",
+            )
+        except ProfilerBusyError as e:
+            self.set_status(409)
+            self.write({"error": str(e)})
+            return
+        self.set_header("Content-Type", "text/plain; charset=utf-8")
+        self.set_header("Content-Disposition", f'attachment; filename="profile-{int(time.time())}.folded"')
+        self.write(folded)
+
+class MemoryProfileHandler(AdminHandler):
+    """Top tracemalloc allocation sites and their growth over ?seconds="""
+    async def get(self):
+        try:
+            self.write(await profile_memory(
+                float(self.get_argument("seconds", "10")),
+                int(self.get_argument("top", "25")),
+            ))
+        except ProfilerBusyError as e:
+            self.set_status(409)
+            self.write({"error": str(e)})
+
+class TelegramWebhookHandler(RequestHandler):
+    """Receive updates from Telegram and hand them to the bot's update queue"""
+    def initialize(self, bot_application: Application):
+        self.bot_application = bot_application
+
+    async def post(self):
+        if Config.WEBHOOK_SECRET:
+            supplied = self.request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not hmac.compare_digest(supplied.encode(), Config.WEBHOOK_SECRET.encode()):
+                self.send_error(403)
+                return
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            self.send_error(400)
+            return
+        update = Update.de_json(data, self.bot_application.bot)
+        if update is None:
+            self.send_error(400)
+            return
+        # Handled by the application's update processor; Telegram only needs a quick 200
+        await self.bot_application.update_queue.put(update)
+        self.set_status(200)
+
 class HealthHandler(RequestHandler):
-    """Simple health check endpoint"""
+    """Simple health check endpoint; not ready until startup warmup has finished"""
     def get(self):
+        if not warmup.ready:
+            self.set_status(503)
+            self.write("WARMING UP")
+            return
         self.write("OK")
 
+def webhook_url() -> str:
+    """Public webhook URL; Telegram only delivers to ports 443, 80, 88 and 8443, so the
+    platform's HTTPS proxy (e.g. Render's) forwards it to WEBHOOK_PORT"""
+    if Config.WEBHOOK_URL:
+        return Config.WEBHOOK_URL
+    return f"https://{os.getenv('RENDER_EXTERNAL_HOSTNAME', 'localhost')}/webhook"
+
+def make_webapp(application: Application) -> TornadoApp:
+    """The HTTP server: Telegram webhook, status, metrics, admin and static routes"""
+    return TornadoApp([
+        (r"/webhook", TelegramWebhookHandler, {"bot_application": application}),
+        (r"/", StatusHandler, {"bot_application": application}),
+        (r"/status", StatusHandler, {"bot_application": application}),
+        (r"/health", HealthHandler),
+        (r"/metrics", MetricsHandler),
+        (r"/admin/traces", TracesHandler),
+        (r"/admin/traces/([0-9a-f]+)", TracesHandler),
+        (r"/admin/profile/cpu", CpuProfileHandler),
+        (r"/admin/profile/memory", MemoryProfileHandler),
+        (r"/static/(.*)", StaticFileHandler, {"path": "static"}),
+        # Add a default handler that serves index.html for all other paths
+        (r"/(.*)", StaticFileHandler, {"path": "static", "default_filename": "index.html"}),
+    ])
+
 async def main():
     """Start the enhanced webhook server with static file serving"""
     # Get bot token from environment
@@ -55,7 +240,17 @@ async def main():
         return
 
     # Create Telegram application
-    application = Application.builder().token(bot_token).build()
+    # Bot API calls made while handling an update show up as spans in its trace
+    # Updates from different chats are handled concurrently, each chat's in order
+    update_processor = ChatOrderedUpdateProcessor(Config.MAX_CONCURRENT_UPDATES)
+    application = (
+        Application.builder()
+        .token(bot_token)
+        .request(TracingRequest(connection_pool_size=256))
+        .rate_limiter(rate_limiter)
+        .concurrent_updates(update_processor)
+        .build()
+    )
 
     # Add command handlers
     application.add_handler(CommandHandler("start", start_handler))
@@ -69,56 +264,62 @@ async def main():
     application.add_handler(MessageHandler(filters.PHOTO | filters.VIDEO, vision_handler))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler))
 
+    # Commands whose API keys are missing answer with a "not configured" message
+    for name, state in services.status().items():
+        if state.startswith("disabled"):
+            logger.warning(f"{name} service {state}")
+    
+    # Preload modules, open API connections and build services while the server comes up
+    warmup.start(services)
+    loop_monitor.start()
+    
     logger.info("Bot started successfully!")
     
-    # Get Render URL (default: *.onrender.com)
-    render_url = os.getenv("RENDER_EXTERNAL_HOSTNAME")
-    if not render_url:
+    if not os.getenv("RENDER_EXTERNAL_HOSTNAME") and not Config.WEBHOOK_URL:
         logger.error("RENDER_EXTERNAL_HOSTNAME not available. Using localhost.")
-        render_url = "localhost"
-        
-    webhook_url = f"https://{render_url}:5000/webhook"  # Using port 5000
-    logger.info(f"Starting enhanced webhook server with URL: {webhook_url}")
+    logger.info(f"Starting enhanced webhook server with URL: {webhook_url()}")
     
-    # Create web application with status endpoints and static file handler
-    webapp = TornadoApp([
-        (r"/", StatusHandler),
-        (r"/status", StatusHandler),
-        (r"/health", HealthHandler),
-        (r"/static/(.*)", StaticFileHandler, {"path": "static"}),
-        # Add a default handler that serves index.html for all other paths
-        (r"/(.*)", StaticFileHandler, {"path": "static", "index.html"}),
-    ])
+    # Create static directory if it doesn't exist
+    os.makedirs("static", exist_ok=True)
     
+    # Serve webhook, status, metrics, admin and static routes ourselves on one port;
+    # PTB's built-in webhook server can't host extra routes
+    server = make_webapp(application).listen(Config.WEBHOOK_PORT, address="0.0.0.0")
+    logger.info(f"HTTP server listening on port {Config.WEBHOOK_PORT}; static files served from ./static")
+    
+    await application.initialize()
+    # Resume media jobs interrupted by the last restart
+    register_jobs(application.bot)
+    await job_queue.start()
+    await application.start()
     try:
-        # Start the webhook
-        await application.initialize()
-        await application.start()
-        
-        # Set up webhook (now listening on port 5000)
-        await application.updater.start_webhook(
-            listen="0.0.0.0",
-            port=5000,  # Changed to port 5000
-            webhook_url=webhook_url,
-            url_path="/webhook",
-            app=webapp
-        )
+        try:
+            await application.bot.set_webhook(
+                url=webhook_url(),
+                secret_token=Config.WEBHOOK_SECRET or None,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            logger.info(f"Webhook set to {webhook_url()}")
+        except Exception as e:
+            # The HTTP server keeps running; only update delivery changes
+            logger.error(f"Setting the webhook failed ({e}); falling back to polling")
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
         
-        logger.info("Webhook server started successfully on port 5000 with static file support")
-        
-        # Create static directory if it doesn't exist
-        os.makedirs("static", exist_ok=True)
-        logger.info("Static files will be served from ./static directory")
-        
-        # Keep running
-        await application.updater.idle()
-        
-    except Exception as e:
-        logger.error(f"Webhook server failed: {e}")
-        # Fallback to polling
-        logger.info("Falling back to polling mode")
-        await application.run_polling(allowed_updates=["message"])
+        # Keep running until cancelled (Ctrl+C / SIGTERM)
+        await asyncio.Event().wait()
+    finally:
+        server.stop()
+        if application.updater.running:
+            await application.updater.stop()
+        await job_queue.stop()
+        await application.stop()
+        await application.shutdown()
+        await flush_caches()
+        await close_http_client()
+        await loop_monitor.stop()
 
 if __name__ == '__main__':
-    AsyncIOMainLoop().install()
-    asyncio.run(main())
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass